@@ -1,9 +1,13 @@
 from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Request
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
+from fastapi.responses import Response, JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring, IndexModel, UpdateOne, UpdateMany, ReturnDocument, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
+from bson import ObjectId
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
@@ -16,23 +20,140 @@ from emergentintegrations.payments.stripe.checkout import StripeCheckout, Checko
 import base64
 import tempfile
 import json
+import hashlib
+import re
 import zipfile
 import io
+import math
+import time
+import threading
+import fcntl
+import calendar
+import types
+from collections import OrderedDict, deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from xml.sax.saxutils import escape as xml_escape
+from email.utils import formatdate, parsedate_to_datetime
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, HRFlowable
 
 ROOT_DIR = Path(__file__).parent
 DESKTOP_DIR = ROOT_DIR.parent / 'desktop'
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# =============================================================================
+# MONGODB CONNECTION
+# =============================================================================
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """
+    Tracks how long requests wait to check a connection out of the pool.
+    pymongo publishes these events synchronously on the thread doing the
+    checkout, so a thread-local is enough to pair start/finish events.
+    """
+
+    def __init__(self, window_seconds: float = 60.0):
+        self.window_seconds = window_seconds
+        self.waits = deque(maxlen=1000)  # (monotonic timestamp, wait ms)
+        self.checkout_failures = deque(maxlen=1000)  # (monotonic timestamp, reason)
+        self.in_use = 0
+        self.open_connections = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.monotonic()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            self.waits.append((time.monotonic(), (time.monotonic() - started) * 1000))
+        with self._lock:
+            self.in_use += 1
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures.append((time.monotonic(), str(event.reason)))
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        cutoff = time.monotonic() - self.window_seconds
+        waits = sorted(ms for ts, ms in list(self.waits) if ts >= cutoff)
+        failures = [reason for ts, reason in list(self.checkout_failures) if ts >= cutoff]
+        return {
+            "window_seconds": self.window_seconds,
+            "checkouts": len(waits),
+            "checkout_wait_p50_ms": round(waits[len(waits) // 2], 2) if waits else 0.0,
+            "checkout_wait_max_ms": round(waits[-1], 2) if waits else 0.0,
+            "checkout_failures": len(failures),
+            "connections_in_use": self.in_use,
+            "connections_open": self.open_connections
+        }
+
+def mongo_client_options() -> dict:
+    """Motor/pymongo pool options from the environment; unset variables keep the driver defaults."""
+    int_options = {
+        "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+        "minPoolSize": "MONGO_MIN_POOL_SIZE",
+        "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+        "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+        "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+        "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+        "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+        "maxConnecting": "MONGO_MAX_CONNECTING"
+    }
+    options = {option: int(os.environ[var]) for option, var in int_options.items() if os.environ.get(var)}
+    if os.environ.get('MONGO_COMPRESSORS'):
+        # e.g. "zstd,snappy,zlib"; zstd and snappy need their optional Python packages
+        options["compressors"] = os.environ['MONGO_COMPRESSORS']
+    return options
+
+pool_monitor = PoolMonitor()
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[pool_monitor], **mongo_client_options())
 db = client[os.environ['DB_NAME']]
 
+# /api/ready reports not-ready above this p50 checkout wait
+READY_MAX_CHECKOUT_WAIT_MS = float(os.environ.get('READY_MAX_CHECKOUT_WAIT_MS', '250'))
+
 # Emergent LLM Key
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY', '')
 
 # Stripe Key
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY', '')
+# Public URL Stripe posts events to, e.g. https://api.example.com/api/webhook/stripe
+STRIPE_WEBHOOK_URL = os.environ.get('STRIPE_WEBHOOK_URL', '')
+# "stripe" in production; "fake" runs billing flows against an in-process stand-in
+PAYMENTS_BACKEND = os.environ.get('PAYMENTS_BACKEND', 'stripe')
 
 # =============================================================================
 # SUBSCRIPTION PLANS CONFIGURATION
@@ -57,7 +178,9 @@ SUBSCRIPTION_PLANS = {
         "mock_interviews": 3,
         "code_sessions": 5,
         "export_enabled": False,
-        "priority_support": False
+        "priority_support": False,
+        "history_retention_days": 7,
+        "pdf_export": False
     },
     "beginner": {
         "name": "Beginner",
@@ -78,7 +201,9 @@ SUBSCRIPTION_PLANS = {
         "mock_interviews": 10,
         "code_sessions": 15,
         "export_enabled": True,
-        "priority_support": False
+        "priority_support": False,
+        "history_retention_days": 30,
+        "pdf_export": False
     },
     "advanced": {
         "name": "Advanced",
@@ -101,7 +226,9 @@ SUBSCRIPTION_PLANS = {
         "mock_interviews": -1,  # Unlimited
         "code_sessions": -1,    # Unlimited
         "export_enabled": True,
-        "priority_support": False
+        "priority_support": False,
+        "history_retention_days": 90,
+        "pdf_export": False
     },
     "executive": {
         "name": "Executive",
@@ -128,6 +255,8 @@ SUBSCRIPTION_PLANS = {
         "code_sessions": -1,
         "export_enabled": True,
         "priority_support": True,
+        "history_retention_days": None,  # Unlimited
+        "pdf_export": True,
         "executive_benefits": {
             "personal_coach": True,
             "resume_optimizer": True,
@@ -179,6 +308,10 @@ class Session(BaseModel):
     updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     is_active: bool = True
     duration_limit: int = 15  # Session duration limit in minutes
+    # Denormalized Q&A summary, maintained by generate_answer/delete_qa_pair
+    qa_count: int = 0
+    last_qa_at: Optional[str] = None
+    last_question_preview: Optional[str] = None
 
 class SessionUpdate(BaseModel):
     job_description: Optional[str] = None
@@ -202,6 +335,7 @@ class UserSubscription(BaseModel):
     current_period_end: Optional[str] = None
     stripe_customer_id: Optional[str] = None
     stripe_subscription_id: Optional[str] = None
+    stripe_session_id: Optional[str] = None  # Checkout that last activated this subscription
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     # Usage tracking
@@ -339,33 +473,16 @@ async def check_subscription_limits(email: str, usage_type: str) -> dict:
         # Anonymous users get free tier limits
         return {"allowed": True, "plan": "free", "limit": 5, "used": 0}
     
-    subscription = await db.subscriptions.find_one({"email": email}, {"_id": 0})
+    subscription = await get_cached_subscription(email)
+    # Defaults to the free plan when there is no subscription
+    plan_id = subscription.get("plan", "free")
+    plan = SUBSCRIPTION_PLANS.get(plan_id, SUBSCRIPTION_PLANS["free"])
+    usage = await get_cached_usage(email, subscription)
     
-    if not subscription:
-        # Default to free plan
-        plan_id = "free"
-        plan = SUBSCRIPTION_PLANS["free"]
-        usage = {"live_interviews_used": 0, "mock_interviews_used": 0, "code_sessions_used": 0}
-    else:
-        plan_id = subscription.get("plan", "free")
-        plan = SUBSCRIPTION_PLANS.get(plan_id, SUBSCRIPTION_PLANS["free"])
-        usage = {
-            "live_interviews_used": subscription.get("live_interviews_used", 0),
-            "mock_interviews_used": subscription.get("mock_interviews_used", 0),
-            "code_sessions_used": subscription.get("code_sessions_used", 0)
-        }
-    
-    # Map usage type to limit field and usage field
-    limit_map = {
-        "live_interview": ("live_interviews", "live_interviews_used"),
-        "mock_interview": ("mock_interviews", "mock_interviews_used"),
-        "code_session": ("code_sessions", "code_sessions_used")
-    }
-    
-    if usage_type not in limit_map:
+    if usage_type not in USAGE_LIMIT_FIELDS:
         return {"allowed": True, "plan": plan_id}
     
-    limit_field, used_field = limit_map[usage_type]
+    limit_field, used_field = USAGE_LIMIT_FIELDS[usage_type]
     limit = plan.get(limit_field, 5)
     used = usage.get(used_field, 0)
     
@@ -396,24 +513,136 @@ async def increment_usage(email: str, usage_type: str):
     if not email:
         return
     
-    field_map = {
-        "live_interview": "live_interviews_used",
-        "mock_interview": "mock_interviews_used",
-        "code_session": "code_sessions_used"
-    }
-    
-    if usage_type not in field_map:
+    if usage_type not in USAGE_LIMIT_FIELDS:
         return
     
-    await db.subscriptions.update_one(
-        {"email": email},
-        {
-            "$inc": {field_map[usage_type]: 1},
-            "$setOnInsert": {"plan": "free", "status": "active"}
-        },
+    await add_usage(email, usage_type, 1)
+
+# Usage type -> (plan limit field, usage period counter)
+USAGE_LIMIT_FIELDS = {
+    "live_interview": ("live_interviews", "live_interviews_used"),
+    "mock_interview": ("mock_interviews", "mock_interviews_used"),
+    "code_session": ("code_sessions", "code_sessions_used")
+}
+USAGE_COUNTERS = tuple(used_field for _, used_field in USAGE_LIMIT_FIELDS.values())
+
+def add_months(moment: datetime, months: int) -> datetime:
+    """Shift a datetime by whole calendar months, clamping the day (Jan 31 + 1 -> Feb 28/29)."""
+    month_index = moment.month - 1 + months
+    year = moment.year + month_index // 12
+    month = month_index % 12 + 1
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+
+def parse_utc(value: str) -> datetime:
+    """Parse a stored ISO timestamp, treating naive values as UTC."""
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def current_usage_period(subscription: dict, now: Optional[datetime] = None) -> tuple:
+    """
+    (period_start, period_end) ISO strings of the monthly usage window containing now.
+
+    Paid subscriptions count months from current_period_start, so quarterly and
+    yearly cycles still reset monthly and a renewal starts a fresh window.
+    Everyone else uses the UTC calendar month.
+    """
+    now = now or datetime.now(timezone.utc)
+    anchor = None
+    if subscription.get("current_period_start"):
+        try:
+            anchor = parse_utc(subscription["current_period_start"])
+        except ValueError:
+            anchor = None
+    if anchor is None:
+        anchor = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    
+    months = (now.year - anchor.year) * 12 + now.month - anchor.month
+    if add_months(anchor, months) > now:
+        months -= 1
+    return add_months(anchor, months).isoformat(), add_months(anchor, months + 1).isoformat()
+
+async def add_usage(email: str, usage_type: str, amount: int):
+    """Adjust a counter in the user's current usage period, creating the bucket on first use."""
+    subscription = await get_cached_subscription(email)
+    period_start, period_end = current_usage_period(subscription)
+    await db.usage_periods.update_one(
+        {"email": email, "period_start": period_start},
+        {"$inc": {USAGE_LIMIT_FIELDS[usage_type][1]: amount}, "$setOnInsert": {"period_end": period_end}},
         upsert=True
     )
+    usage_cache.invalidate(email)
+    await record_usage_event(email, usage_type, subscription.get("plan", "free"), amount)
+
+async def reserve_usage(email: str, usage_type: str) -> dict:
+    """
+    Atomically check the plan limit and take one unit of usage.
+
+    A single find_one_and_update on the current usage period runs a pipeline
+    that only increments the counter while it is under the plan's limit, and
+    returns the bucket as it was before the update. That pre-image tells us
+    whether the increment happened, so allowed and rejected requests both cost
+    one round-trip and concurrent requests can't overshoot the limit.
+    Returns the same shape as check_subscription_limits.
+    """
+    if not email or usage_type not in USAGE_LIMIT_FIELDS:
+        return await check_subscription_limits(email, usage_type)
+    
+    subscription = await get_cached_subscription(email)
+    plan_id = subscription.get("plan", "free")
+    plan = SUBSCRIPTION_PLANS.get(plan_id, SUBSCRIPTION_PLANS["free"])
+    limit_field, used_field = USAGE_LIMIT_FIELDS[usage_type]
+    limit = plan.get(limit_field, 5)
+    period_start, period_end = current_usage_period(subscription)
+    
+    used_expr = {"$ifNull": [f"${used_field}", 0]}
+    has_room = True if limit == -1 else {"$lt": [used_expr, limit]}
+    before = await db.usage_periods.find_one_and_update(
+        {"email": email, "period_start": period_start},
+        [{"$set": {
+            "period_end": {"$literal": period_end},
+            used_field: {"$cond": [has_room, {"$add": [used_expr, 1]}, used_expr]}
+        }}],
+        projection={"_id": 0, used_field: 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    usage_cache.invalidate(email)
+    
+    # No pre-image means this is the first use in the period
+    used_before = (before or {}).get(used_field, 0)
+    allowed = limit == -1 or used_before < limit
+    if allowed:
+        await record_usage_event(email, usage_type, plan_id, 1)
+    used = used_before + 1 if allowed else used_before
+    
+    return {
+        "allowed": allowed,
+        "plan": plan_id,
+        "limit": limit,
+        "used": used,
+        "remaining": -1 if limit == -1 else max(0, limit - used),
+        "duration_limit": plan.get("session_duration_minutes", 15),
+        "reason": None if allowed else f"You've used {used}/{limit} {usage_type.replace('_', ' ')}s this month"
+    }
+
+async def release_usage(email: str, usage_type: str):
+    """Give back a unit taken by reserve_usage when the guarded operation fails."""
+    if not email or usage_type not in USAGE_LIMIT_FIELDS:
+        return
+    used_field = USAGE_LIMIT_FIELDS[usage_type][1]
+    subscription = await get_cached_subscription(email)
+    period_start, _ = current_usage_period(subscription)
+    result = await db.usage_periods.update_one(
+        {"email": email, "period_start": period_start, used_field: {"$gt": 0}},
+        {"$inc": {used_field: -1}}
+    )
+    usage_cache.invalidate(email)
+    if result.modified_count:
+        await record_usage_event(email, usage_type, subscription.get("plan", "free"), -1)
 
+# Session context strings come from the blob LRU, so repeat calls pass the same
+# string objects and hit this cache without rehashing multi-KB texts
+@lru_cache(maxsize=256)
 def get_system_prompt(domain: str, tone: str, job_description: str = None, resume: str = None, company_name: str = None, role_title: str = None) -> str:
     domain_prompts = {
         "frontend": "You are an expert frontend developer with deep knowledge of React, Vue, Angular, CSS, HTML, JavaScript/TypeScript, and modern web development practices.",
@@ -446,63 +675,2233 @@ def get_system_prompt(domain: str, tone: str, job_description: str = None, resum
     
     base_prompt = f"""You are helping a job candidate during a technical interview. Your goal is to provide excellent answers that sound natural and human - NOT like they're being read from the internet or AI-generated.
 
-{domain_prompts.get(domain, domain_prompts['general'])}
+{domain_prompts.get(domain, domain_prompts['general'])}
+
+{tone_instructions.get(tone, tone_instructions['professional'])}{context_section}
+
+CRITICAL RULES:
+1. Give answers that sound like a real person speaking naturally
+2. Use first-person perspective ("I would...", "In my experience...", "I've found that...")
+3. Include occasional conversational elements but don't overdo it
+4. Be specific with examples from real-world scenarios
+5. Never say "As an AI" or reference being an AI assistant
+6. Avoid overly formal or robotic language
+7. If resume context is provided, reference specific experiences and projects when relevant
+8. If job description is provided, align answers to highlight relevant skills
+
+ANSWER FORMAT - Use this structure:
+**Key Points:**
+• [First key point - concise, actionable]
+• [Second key point - with specific example if relevant]
+• [Third key point - practical insight]
+
+**Brief Explanation:**
+[1-2 sentences expanding on the key points in a natural, conversational way. Keep it short and interview-ready.]
+"""
+    return base_prompt
+
+async def get_ai_response(question: str, ai_model: str, domain: str, tone: str, context: str = None, job_description: str = None, resume: str = None, company_name: str = None, role_title: str = None) -> str:
+    """Generate AI response using the specified model."""
+    
+    system_prompt = get_system_prompt(domain, tone, job_description, resume, company_name, role_title)
+    
+    if context:
+        full_question = f"Context:\n{context}\n\nQuestion: {question}"
+    else:
+        full_question = question
+    
+    session_id = str(uuid.uuid4())
+    
+    chat = LlmChat(
+        api_key=EMERGENT_LLM_KEY,
+        session_id=session_id,
+        system_message=system_prompt
+    )
+    
+    # Configure model based on selection
+    if ai_model == "gpt-5.2":
+        chat.with_model("openai", "gpt-5.2")
+    elif ai_model == "claude-sonnet-4.5":
+        chat.with_model("anthropic", "claude-sonnet-4-5-20250929")
+    elif ai_model == "gemini-3-flash":
+        chat.with_model("gemini", "gemini-3-flash-preview")
+    else:
+        chat.with_model("openai", "gpt-5.2")
+    
+    user_message = UserMessage(text=full_question)
+    response = await chat.send_message(user_message)
+    
+    return response
+
+# =============================================================================
+# SESSION SUMMARY COUNTERS
+# =============================================================================
+
+QUESTION_PREVIEW_LENGTH = 120
+
+def question_preview(question: str) -> str:
+    question = " ".join(question.split())
+    if len(question) <= QUESTION_PREVIEW_LENGTH:
+        return question
+    return question[:QUESTION_PREVIEW_LENGTH - 1].rstrip() + "…"
+
+def session_summary_update(session_id: str, qa_pairs: List[dict]) -> UpdateOne:
+    """Build the atomic update that folds newly stored pairs into the session's Q&A counters."""
+    newest = max(qa_pairs, key=lambda qa: qa["created_at"])
+    created_at = newest["created_at"]
+    is_newest = {"$gte": [created_at, {"$ifNull": ["$last_qa_at", ""]}]}
+    # Pipeline update: every expression sees the document as it was before the write
+    return UpdateOne(
+        {"id": session_id},
+        [{"$set": {
+            "qa_count": {"$add": [{"$ifNull": ["$qa_count", 0]}, len(qa_pairs)]},
+            "updated_at": {"$literal": created_at},
+            "last_qa_at": {"$cond": [is_newest, {"$literal": created_at}, "$last_qa_at"]},
+            "last_question_preview": {"$cond": [
+                is_newest, {"$literal": question_preview(newest["question"])}, "$last_question_preview"
+            ]}
+        }}]
+    )
+
+async def record_qa_removed(session_id: str, qa_pair: dict):
+    """Decrement the session's Q&A counters and re-point last_* if the newest pair was removed."""
+    latest = await db.qa_pairs.find_one(
+        {"session_id": session_id},
+        {"_id": 0, "created_at": 1, "question": 1},
+        sort=[("created_at", -1), ("id", -1)]
+    )
+    latest_at = latest["created_at"] if latest else None
+    latest_preview = question_preview(latest["question"]) if latest else None
+    # Leave last_* alone if a newer pair was recorded since the lookup above
+    was_newest = {"$lte": [{"$ifNull": ["$last_qa_at", ""]}, qa_pair["created_at"]]}
+    await db.sessions.update_one(
+        {"id": session_id},
+        [{"$set": {
+            "qa_count": {"$max": [0, {"$subtract": [{"$ifNull": ["$qa_count", 0]}, 1]}]},
+            "last_qa_at": {"$cond": [was_newest, {"$literal": latest_at}, "$last_qa_at"]},
+            "last_question_preview": {"$cond": [
+                was_newest, {"$literal": latest_preview}, "$last_question_preview"
+            ]}
+        }}]
+    )
+
+def session_summary_pipeline(match: Optional[dict] = None) -> List[dict]:
+    """Aggregation computing each session's Q&A counters from qa_pairs."""
+    return ([{"$match": match}] if match else []) + [
+        {"$sort": {"session_id": 1, "created_at": 1, "id": 1}},
+        {"$group": {
+            "_id": "$session_id",
+            "qa_count": {"$sum": 1},
+            "last_qa_at": {"$last": "$created_at"},
+            "last_question": {"$last": "$question"}
+        }}
+    ]
+
+def session_summary_reset(summary: dict) -> UpdateOne:
+    """Overwrite a session's Q&A counters with values recomputed by session_summary_pipeline."""
+    return UpdateOne(
+        {"id": summary["_id"]},
+        {"$set": {
+            "qa_count": summary["qa_count"],
+            "last_qa_at": summary["last_qa_at"],
+            "last_question_preview": question_preview(summary["last_question"])
+        }}
+    )
+
+async def backfill_session_summaries() -> dict:
+    """Recompute qa_count/last_qa_at/last_question_preview for every session from qa_pairs."""
+    summaries = db.qa_pairs.aggregate(session_summary_pipeline(), allowDiskUse=True)
+    
+    updated = 0
+    batch = []
+    async for summary in summaries:
+        batch.append(session_summary_reset(summary))
+        if len(batch) >= 500:
+            updated += (await db.sessions.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await db.sessions.bulk_write(batch, ordered=False)).modified_count
+    
+    # Sessions without any Q&A pairs never show up in the aggregation above
+    empty = await db.sessions.update_many(
+        {"qa_count": {"$exists": False}},
+        {"$set": {"qa_count": 0, "last_qa_at": None, "last_question_preview": None}}
+    )
+    return {"sessions_updated": updated, "empty_sessions_initialized": empty.modified_count}
+
+# =============================================================================
+# HISTORY RETENTION
+# =============================================================================
+
+# Sessions and their Q&A pairs carry a BSON date `expires_at` derived from the
+# owner's plan; TTL indexes on both collections do the actual removal. Plans
+# with unlimited history leave the field unset.
+
+def retention_expiry(plan_id: str, created_at: str) -> Optional[datetime]:
+    plan = SUBSCRIPTION_PLANS.get(plan_id, SUBSCRIPTION_PLANS["free"])
+    days = plan.get("history_retention_days")
+    if days is None:
+        return None
+    return datetime.fromisoformat(created_at) + timedelta(days=days)
+
+async def get_plan_id(email: Optional[str]) -> str:
+    if not email:
+        return "free"
+    subscription = await get_cached_subscription(email)
+    return subscription.get("plan", "free")
+
+async def recompute_retention(email: Optional[str], batch_size: int = 500) -> dict:
+    """Re-derive expires_at on all of a user's sessions and Q&A pairs from their current plan."""
+    plan_id = await get_plan_id(email)
+    session_ops, qa_ops = [], []
+    updated = 0
+    
+    async def flush():
+        if session_ops:
+            await db.sessions.bulk_write(session_ops, ordered=False)
+            await db.qa_pairs.bulk_write(qa_ops, ordered=False)
+            session_ops.clear()
+            qa_ops.clear()
+    
+    async for session in db.sessions.find({"email": email}, {"_id": 0, "id": 1, "created_at": 1}):
+        expires_at = retention_expiry(plan_id, session["created_at"])
+        change = {"$set": {"expires_at": expires_at}} if expires_at else {"$unset": {"expires_at": ""}}
+        session_ops.append(UpdateOne({"id": session["id"]}, change))
+        qa_ops.append(UpdateMany({"session_id": session["id"]}, change))
+        session_context_cache.invalidate(session["id"])
+        updated += 1
+        if len(session_ops) >= batch_size:
+            await flush()
+    await flush()
+    return {"email": email, "plan": plan_id, "sessions_updated": updated}
+
+async def recompute_all_retention() -> dict:
+    """Backfill/repair expires_at for every session owner, including anonymous sessions."""
+    emails = await db.sessions.distinct("email")
+    results = [await recompute_retention(email) for email in emails]
+    return {"owners": len(results), "sessions_updated": sum(r["sessions_updated"] for r in results)}
+
+background_tasks = set()
+
+def run_in_background(coro):
+    """Fire-and-forget a coroutine, keeping a reference so it isn't garbage collected."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# =============================================================================
+# Q&A WRITE-BEHIND PERSISTER
+# =============================================================================
+
+QA_OUTBOX_PATH = Path(os.environ.get('QA_OUTBOX_PATH', str(ROOT_DIR / 'data' / 'qa_outbox.jsonl')))
+
+class QAWriteBehind:
+    """
+    Persists Q&A pairs off the answer path. Each pair is appended to a local
+    JSONL outbox (fsynced) before the request returns, then written to Mongo
+    in batches with insert_many plus one summary update per session. The
+    outbox is truncated once everything in it is stored and is replayed on
+    startup, so pairs survive a shutdown or a Mongo outage.
+
+    Outbox appends run on a writer thread; concurrent requests share one
+    write + fsync (group commit). Each worker process claims its own outbox
+    slot (`qa_outbox.<n>.jsonl`), held with an flock for the process lifetime,
+    and adopts the slots of workers that exited without draining theirs.
+    """
+
+    def __init__(self, outbox_path: Path, batch_size: int = 100, flush_interval: float = 0.05):
+        self.base_path = outbox_path
+        self.outbox_path = None
+        self._outbox_lock = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[dict] = []
+        self._pending_ids = set()
+        self._pending_sessions: Dict[str, int] = {}
+        self._wakeup = None
+        self._flushed = None
+        self._task = None
+        self._stopping = False
+        self._failed = False
+        self._appends: List[tuple] = []
+        self._append_wakeup = None
+        self._truncate = False
+        self._writer = None
+        self._closing = False
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._flushed = asyncio.Condition()
+        self._append_wakeup = asyncio.Event()
+        self._stopping = False
+        self._appends, self._truncate, self._closing = [], False, False
+        if not self.outbox_path:
+            self._claim_outbox()
+        self._adopt_orphaned_outboxes()
+        # The outbox is the source of truth for anything not yet stored
+        self._buffer, self._pending_ids, self._pending_sessions = [], set(), {}
+        replayed = self._read_outbox()
+        for doc in replayed:
+            self._track(doc)
+        if replayed:
+            logger.info(f"Replaying {len(replayed)} Q&A pairs from outbox")
+        self._task = asyncio.create_task(self._run())
+        self._writer = asyncio.create_task(self._write_outbox())
+
+    async def stop(self):
+        """Drain the buffer. Anything that still can't be written stays in the outbox."""
+        if not self._task:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=10)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            logger.error(f"Q&A persister stopped with {len(self._buffer)} pairs left in outbox")
+        # The writer exits once the persister is done and its appends are on disk
+        self._closing = True
+        self._append_wakeup.set()
+        await self._writer
+        self._task = self._writer = None
+
+    async def enqueue(self, doc: dict):
+        # Tracked before the append, so a truncate (which needs an empty buffer)
+        # can never drop a line whose pair hasn't reached Mongo
+        self._track(doc)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        written = asyncio.get_running_loop().create_future()
+        self._appends.append((json.dumps(doc) + "\n", written))
+        self._append_wakeup.set()
+        await written
+
+    def is_pending(self, session_id: str = None, qa_id: str = None) -> bool:
+        return session_id in self._pending_sessions or qa_id in self._pending_ids
+
+    async def sync(self, timeout: float = 5.0):
+        """Wait until everything enqueued so far has reached Mongo (read-your-writes)."""
+        if not self._buffer or not self._task:
+            return
+        self._wakeup.set()
+        async with self._flushed:
+            try:
+                await asyncio.wait_for(self._flushed.wait_for(lambda: not self._buffer), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Timed out waiting for Q&A persister to flush")
+
+    def _track(self, doc: dict):
+        self._buffer.append(doc)
+        self._pending_ids.add(doc["id"])
+        self._pending_sessions[doc["session_id"]] = self._pending_sessions.get(doc["session_id"], 0) + 1
+
+    def _slot_path(self, slot: int) -> Path:
+        return self.base_path.with_name(f"{self.base_path.stem}.{slot}{self.base_path.suffix}")
+
+    @staticmethod
+    def _try_lock(path: Path):
+        """Take an exclusive flock on `<path>.lock`, or return None if another process holds it."""
+        lock = open(path.with_name(path.name + ".lock"), "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def _claim_outbox(self):
+        self.base_path.parent.mkdir(parents=True, exist_ok=True)
+        slot = 0
+        while True:
+            path = self._slot_path(slot)
+            lock = self._try_lock(path)
+            if lock:
+                # Kept open (and so locked) until the process exits
+                self.outbox_path, self._outbox_lock = path, lock
+                return
+            slot += 1
+
+    def _adopt_orphaned_outboxes(self):
+        """Move entries from outboxes no live process holds (and the pre-slot path) into ours."""
+        orphans = [self.base_path] + sorted(self.base_path.parent.glob(f"{self.base_path.stem}.*{self.base_path.suffix}"))
+        for path in orphans:
+            if path == self.outbox_path or not path.exists() or not path.stat().st_size:
+                continue
+            lock = self._try_lock(path)
+            if not lock:
+                continue
+            try:
+                with open(path) as orphan:
+                    lines = [line if line.endswith("\n") else line + "\n" for line in orphan]
+                self._append_lines(lines)
+                open(path, "w").close()
+                logger.info(f"Adopted {len(lines)} Q&A outbox entries from {path.name}")
+            finally:
+                lock.close()
+
+    def _append_lines(self, lines: List[str]):
+        with open(self.outbox_path, "a") as outbox:
+            outbox.writelines(lines)
+            outbox.flush()
+            os.fsync(outbox.fileno())
+
+    async def _write_outbox(self):
+        while True:
+            await self._append_wakeup.wait()
+            self._append_wakeup.clear()
+            if self._appends:
+                appends, self._appends = self._appends, []
+                try:
+                    await asyncio.to_thread(self._append_lines, [line for line, _ in appends])
+                except Exception as e:
+                    # The pairs are still buffered for Mongo; only the crash protection is lost
+                    logger.error(f"Q&A outbox append failed: {str(e)}")
+                for _, written in appends:
+                    if not written.done():
+                        written.set_result(None)
+            if self._truncate and not self._buffer and not self._appends:
+                # Every line on disk belongs to a pair that is already stored
+                try:
+                    await asyncio.to_thread(self._truncate_outbox)
+                    self._truncate = False
+                except Exception as e:
+                    # Left requested, so the next wakeup retries; replaying stored pairs is harmless
+                    logger.error(f"Q&A outbox truncate failed: {str(e)}")
+            if self._closing and not self._appends:
+                return
+
+    def _truncate_outbox(self):
+        open(self.outbox_path, "w").close()
+
+    def _read_outbox(self) -> List[dict]:
+        if not self.outbox_path.exists():
+            return []
+        docs = []
+        with open(self.outbox_path) as outbox:
+            for line in outbox:
+                try:
+                    docs.append(json.loads(line))
+                except ValueError:
+                    # A torn final line from a crash mid-write; the request never returned
+                    logger.warning("Skipping unreadable Q&A outbox entry")
+        return docs
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._buffer:
+                await self._flush_batch()
+            if self._stopping and (not self._buffer or self._failed):
+                return
+
+    async def _flush_batch(self):
+        batch = self._buffer[:self.batch_size]
+        try:
+            await self._persist(batch)
+            self._failed = False
+        except Exception as e:
+            logger.error(f"Q&A persister write failed, will retry: {str(e)}")
+            self._failed = True
+            await asyncio.sleep(1)
+            return
+        
+        del self._buffer[:len(batch)]
+        for doc in batch:
+            self._pending_ids.discard(doc["id"])
+            remaining = self._pending_sessions.get(doc["session_id"], 1) - 1
+            if remaining:
+                self._pending_sessions[doc["session_id"]] = remaining
+            else:
+                self._pending_sessions.pop(doc["session_id"], None)
+        if not self._buffer:
+            self._truncate = True
+            self._append_wakeup.set()
+        async with self._flushed:
+            self._flushed.notify_all()
+
+    @staticmethod
+    def _to_mongo(doc: dict) -> dict:
+        doc = dict(doc)
+        # The outbox is JSON, so the TTL date travels as an ISO string
+        if doc.get("expires_at"):
+            doc["expires_at"] = datetime.fromisoformat(doc["expires_at"])
+        return doc
+
+    async def _persist(self, batch: List[dict]):
+        recount = set()
+        try:
+            # Copies, because insert_many adds _id to the documents it is given
+            await db.qa_pairs.insert_many([self._to_mongo(doc) for doc in batch], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            # Duplicate ids were stored by an earlier attempt (outbox replay, or a
+            # retry after the summary update failed), so whether their counters
+            # were applied is unknown; recount those sessions from qa_pairs
+            recount = {batch[err["index"]]["session_id"] for err in errors}
+        
+        by_session: Dict[str, List[dict]] = {}
+        for doc in batch:
+            if doc["session_id"] not in recount:
+                by_session.setdefault(doc["session_id"], []).append(doc)
+        updates = [session_summary_update(session_id, docs) for session_id, docs in by_session.items()]
+        if recount:
+            summaries = db.qa_pairs.aggregate(session_summary_pipeline({"session_id": {"$in": list(recount)}}))
+            updates += [session_summary_reset(summary) async for summary in summaries]
+        if updates:
+            await db.sessions.bulk_write(updates, ordered=False)
+
+qa_persister = QAWriteBehind(QA_OUTBOX_PATH)
+
+# =============================================================================
+# SESSION CASCADE DELETION
+# =============================================================================
+
+class SessionCascadeDeleter:
+    """
+    Removes tombstoned sessions in the background. Q&A pairs are deleted in
+    bounded _id ranges with a pause between batches so a session with
+    thousands of pairs never turns into one long delete on the primary. The
+    session document goes last, which keeps the tombstone visible (and the
+    job resumable) if the process stops halfway.
+    """
+
+    def __init__(self, batch_size: int = 500, batch_pause: float = 0.05, poll_interval: float = 30.0):
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.poll_interval = poll_interval
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.purge_tombstoned()
+            except Exception as e:
+                logger.error(f"Session cascade delete error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def purge_tombstoned(self) -> int:
+        purged = 0
+        async for session in db.sessions.find({"deleted_at": {"$ne": None}}, {"_id": 0, "id": 1}):
+            if await self.purge_session(session["id"]):
+                purged += 1
+        return purged
+
+    async def purge_session(self, session_id: str) -> bool:
+        while True:
+            batch = await db.qa_pairs.find(
+                {"session_id": session_id}, {"_id": 1}
+            ).sort("_id", ASCENDING).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                break
+            await db.qa_pairs.delete_many({
+                "session_id": session_id,
+                "_id": {"$gte": batch[0]["_id"], "$lte": batch[-1]["_id"]}
+            })
+            await asyncio.sleep(self.batch_pause)
+        
+        # Pairs still in the write-behind buffer would land after the cascade; retry next round
+        if qa_persister.is_pending(session_id=session_id):
+            return False
+        await db.sessions.delete_one({"id": session_id, "deleted_at": {"$ne": None}})
+        return True
+
+session_cascade = SessionCascadeDeleter()
+
+# =============================================================================
+# SESSION EXPIRY
+# =============================================================================
+
+# Allowance past duration_limit for client clock skew and a last in-flight question
+SESSION_EXPIRY_GRACE_SECONDS = float(os.environ.get('SESSION_EXPIRY_GRACE_SECONDS', '60'))
+
+def session_deadline(session: dict) -> Optional[float]:
+    """Epoch seconds after which a session stops accepting answers, or None without a limit."""
+    if not session.get("created_at") or not session.get("duration_limit") or session["duration_limit"] <= 0:
+        return None
+    try:
+        created_at = parse_utc(session["created_at"])
+    except ValueError:
+        return None
+    return created_at.timestamp() + session["duration_limit"] * 60 + SESSION_EXPIRY_GRACE_SECONDS
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel: `levels` wheels of `slots` buckets, each level
+    `slots` times coarser than the one below. A timer lives in the coarsest
+    level that still separates it from now and drops a level each time that
+    wheel turns over, so add/cancel are O(1) and each tick touches one bucket
+    plus occasional cascades. Timers beyond the top wheel wait in an overflow
+    set that is re-sorted once per top-level turn.
+    """
+
+    def __init__(self, tick_seconds: float = 1.0, slots: int = 64, levels: int = 4, now: Optional[float] = None):
+        self.tick_seconds = tick_seconds
+        self.slots = slots
+        self.levels = levels
+        self.current = int((time.time() if now is None else now) / tick_seconds)
+        self._wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self._overflow = set()
+        self._timers: Dict[str, tuple] = {}  # key -> (due tick, bucket)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key: str):
+        return key in self._timers
+
+    def add(self, key: str, deadline: float):
+        self.cancel(key)
+        self._place(key, max(math.ceil(deadline / self.tick_seconds), self.current))
+
+    def cancel(self, key: str):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer[1].discard(key)
+
+    def _place(self, key: str, due: int):
+        delta = due - self.current
+        bucket = self._overflow
+        for level in range(self.levels):
+            if delta < self.slots ** (level + 1):
+                bucket = self._wheels[level][(due // self.slots ** level) % self.slots]
+                break
+        bucket.add(key)
+        self._timers[key] = (due, bucket)
+
+    def _respread(self, bucket: set):
+        keys = list(bucket)
+        bucket.clear()
+        for key in keys:
+            self._place(key, self._timers[key][0])
+
+    def advance(self, now: Optional[float] = None) -> List[str]:
+        """Move the wheel up to now; returns keys whose deadline has passed."""
+        target = int((time.time() if now is None else now) / self.tick_seconds)
+        expired = []
+        # Anything due at the current tick was placed after it was processed
+        expired.extend(self._pop(self._wheels[0][self.current % self.slots]))
+        while self.current < target:
+            self.current += 1
+            if self.current % self.slots ** (self.levels - 1) == 0:
+                self._respread(self._overflow)
+            for level in range(self.levels - 1, 0, -1):
+                if self.current % self.slots ** level == 0:
+                    self._respread(self._wheels[level][(self.current // self.slots ** level) % self.slots])
+            expired.extend(self._pop(self._wheels[0][self.current % self.slots]))
+        return expired
+
+    def _pop(self, bucket: set) -> List[str]:
+        keys = list(bucket)
+        bucket.clear()
+        for key in keys:
+            del self._timers[key]
+        return keys
+
+class SessionExpiryService:
+    """
+    Ends sessions at created_at + duration_limit (+ grace). Deadlines of active
+    sessions are loaded into a TimerWheel at startup and added as sessions are
+    created; each tick's expirations are flipped to is_active=False with
+    update_many in batches. Every instance loads all active sessions, and the
+    is_active filter makes overlapping expirations harmless.
+    """
+
+    def __init__(self, tick_seconds: float = 1.0, batch_size: int = 500):
+        self.tick_seconds = tick_seconds
+        self.batch_size = batch_size
+        self.wheel = TimerWheel(tick_seconds=tick_seconds)
+        self._due: List[str] = []
+        self._task = None
+
+    async def start(self):
+        await self.rebuild()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def rebuild(self) -> int:
+        self.wheel = TimerWheel(tick_seconds=self.tick_seconds)
+        self._due = []
+        cursor = db.sessions.find(
+            {"is_active": True, "deleted_at": None, "duration_limit": {"$gt": 0}},
+            {"_id": 0, "id": 1, "created_at": 1, "duration_limit": 1}
+        )
+        async for session in cursor:
+            self.schedule(session)
+        return len(self.wheel)
+
+    def schedule(self, session: dict):
+        deadline = session_deadline(session)
+        if deadline is not None:
+            self.wheel.add(session["id"], deadline)
+
+    def cancel(self, session_id: str):
+        self.wheel.cancel(session_id)
+
+    async def _run(self):
+        while True:
+            self._due.extend(self.wheel.advance())
+            try:
+                await self.expire_due()
+            except Exception as e:
+                logger.error(f"Session expiry error: {str(e)}")
+            await asyncio.sleep(self.tick_seconds)
+
+    async def expire_due(self) -> int:
+        expired = 0
+        while self._due:
+            batch = self._due[:self.batch_size]
+            result = await db.sessions.update_many(
+                {"id": {"$in": batch}, "is_active": True},
+                {"$set": {"is_active": False, "ended_reason": "duration_limit", "updated_at": datetime.now(timezone.utc).isoformat()}}
+            )
+            # Only drop the batch once it is written so a failed update retries next tick
+            del self._due[:len(batch)]
+            expired += result.modified_count
+        return expired
+
+session_expiry = SessionExpiryService()
+
+# =============================================================================
+# USAGE EVENTS & ROLLUPS
+# =============================================================================
+
+USAGE_EVENT_RETENTION_DAYS = int(os.environ.get('USAGE_EVENT_RETENTION_DAYS', '90'))
+ROLLUP_GRANULARITIES = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+MAX_ROLLUP_BUCKETS = 1000
+
+async def record_usage_event(email: str, usage_type: str, plan_id: str, amount: int):
+    """
+    Append one usage event; raw events expire, the rollups built from them don't.
+    Best-effort: callers have already moved the quota counter, so a failed
+    insert is logged rather than failing the request that consumed the unit.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.usage_events.insert_one({
+            "email": email,
+            "usage_type": usage_type,
+            "plan": plan_id,
+            "amount": amount,
+            "at": now,
+            "expires_at": now + timedelta(days=USAGE_EVENT_RETENTION_DAYS)
+        })
+    except Exception as e:
+        logger.error(f"Failed to record usage event for {usage_type}: {str(e)}")
+
+def rollup_bucket(moment: datetime, granularity: str) -> datetime:
+    """Start of the hour or day containing moment."""
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == "day" else moment
+
+class UsageRollupAggregator:
+    """
+    Folds new usage events into hourly and daily counts per plan and usage
+    type. Progress is a watermark on the event _id stored in db.job_state;
+    events younger than `lag` seconds are left for the next pass so inserts
+    still in flight (ObjectIds are minted client-side) aren't skipped. Each
+    batch is claimed by moving the watermark with a compare-and-set before its
+    counts are applied, so instances running side by side never count the
+    same events twice; a crash between the claim and the counts drops at most
+    one batch.
+    """
+
+    STATE_ID = "usage_rollups"
+
+    def __init__(self, interval: float = 60.0, lag: float = 5.0, batch_size: int = 5000):
+        self.interval = interval
+        self.lag = lag
+        self.batch_size = batch_size
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.aggregate()
+            except Exception as e:
+                logger.error(f"Usage rollup error: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def aggregate(self) -> dict:
+        try:
+            await db.job_state.insert_one({"_id": self.STATE_ID, "last_event_id": None})
+        except DuplicateKeyError:
+            pass
+        state = await db.job_state.find_one({"_id": self.STATE_ID})
+        watermark = state.get("last_event_id")
+        cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=self.lag))
+        processed = 0
+        while True:
+            id_range = {"$lt": cutoff}
+            if watermark is not None:
+                id_range["$gt"] = watermark
+            events = await db.usage_events.find(
+                {"_id": id_range}, {"_id": 1, "usage_type": 1, "plan": 1, "amount": 1, "at": 1}
+            ).sort("_id", ASCENDING).limit(self.batch_size).to_list(self.batch_size)
+            if not events:
+                break
+            
+            claimed = await db.job_state.find_one_and_update(
+                {"_id": self.STATE_ID, "last_event_id": watermark},
+                {"$set": {"last_event_id": events[-1]["_id"], "updated_at": datetime.now(timezone.utc)}}
+            )
+            if claimed is None:
+                # Another instance moved the watermark first and owns this range
+                break
+            watermark = events[-1]["_id"]
+            
+            counts = {}
+            for event in events:
+                at = event["at"].replace(tzinfo=timezone.utc)
+                for granularity in ROLLUP_GRANULARITIES:
+                    key = (granularity, rollup_bucket(at, granularity), event["plan"], event["usage_type"])
+                    counts[key] = counts.get(key, 0) + event.get("amount", 1)
+            await db.usage_rollups.bulk_write([
+                UpdateOne(
+                    {"granularity": granularity, "bucket": bucket, "plan": plan_id, "usage_type": usage_type},
+                    {"$inc": {"count": count}},
+                    upsert=True
+                )
+                for (granularity, bucket, plan_id, usage_type), count in counts.items()
+            ], ordered=False)
+            processed += len(events)
+        return {"events_processed": processed}
+
+usage_rollups = UsageRollupAggregator()
+
+# =============================================================================
+# Q&A SEARCH
+# =============================================================================
+
+SNIPPET_LENGTH = 160
+
+def search_terms(query: str) -> List[str]:
+    return [term for term in re.findall(r"\w+", query.lower()) if len(term) > 1]
+
+def highlight_snippet(text: str, terms: List[str]) -> dict:
+    """
+    Cut a window of `text` around the first matching term and return it with
+    [start, end) offsets of every match inside the window. Terms match as word
+    prefixes so "partition" also marks "partitions".
+    """
+    if not text:
+        return {"text": "", "matches": []}
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(t) for t in terms) + r")\w*", re.IGNORECASE) if terms else None
+    first = pattern.search(text) if pattern else None
+    
+    start = 0
+    if first and first.start() > SNIPPET_LENGTH // 3:
+        start = first.start() - SNIPPET_LENGTH // 3
+        # Don't start mid-word
+        space = text.rfind(" ", 0, start)
+        start = space + 1 if space != -1 else start
+    window = text[start:start + SNIPPET_LENGTH]
+    matches = [[m.start(), m.end()] for m in pattern.finditer(window)] if pattern else []
+    
+    return {
+        "text": ("…" if start > 0 else "") + window + ("…" if start + SNIPPET_LENGTH < len(text) else ""),
+        # Shift offsets past the leading ellipsis
+        "matches": [[s + 1, e + 1] for s, e in matches] if start > 0 else matches
+    }
+
+# =============================================================================
+# DATABASE INDEXES
+# =============================================================================
+
+# Every query in this module should be served by one of these indexes
+# (sessions.distinct("email") walks the email prefix of email_created_at_id).
+# create_indexes() is idempotent, so this runs on every startup.
+COLLECTION_INDEXES = {
+    "sessions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("email", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="email_created_at_id"),
+        IndexModel([("deleted_at", ASCENDING)], name="deleted_at", sparse=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel([("job_description_hash", ASCENDING)], name="job_description_hash", sparse=True),
+        IndexModel([("resume_hash", ASCENDING)], name="resume_hash", sparse=True),
+        # SessionExpiryService.rebuild loads active, undeleted sessions at startup
+        IndexModel([("is_active", ASCENDING), ("deleted_at", ASCENDING)], name="is_active_deleted_at"),
+    ],
+    "qa_pairs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("session_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="session_id_created_at_id"),
+        IndexModel([("session_id", ASCENDING), ("_id", ASCENDING)], name="session_id_oid"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel(
+            [("question", TEXT), ("answer", TEXT)],
+            name="question_answer_text",
+            weights={"question": 3, "answer": 1},
+            default_language="english"
+        ),
+    ],
+    "subscriptions": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "usage_periods": [
+        IndexModel([("email", ASCENDING), ("period_start", ASCENDING)], name="email_period_start_unique", unique=True),
+    ],
+    "usage_events": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "usage_rollups": [
+        IndexModel(
+            [("granularity", ASCENDING), ("bucket", ASCENDING), ("plan", ASCENDING), ("usage_type", ASCENDING)],
+            name="granularity_bucket_plan_usage_type_unique",
+            unique=True
+        ),
+    ],
+    "webhook_events": [
+        IndexModel([("event_id", ASCENDING)], name="event_id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease_until"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+    ],
+    "releases": [
+        IndexModel([("platform", ASCENDING), ("is_latest", ASCENDING)], name="platform_is_latest"),
+        IndexModel([("platform", ASCENDING), ("created_at", DESCENDING)], name="platform_created_at"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    "blobs": [
+        IndexModel([("hash", ASCENDING)], name="hash_unique", unique=True),
+        IndexModel([("referenced_at", ASCENDING)], name="referenced_at"),
+    ],
+    "settings": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+}
+
+async def ensure_indexes() -> dict:
+    """Create all declared indexes. Returns created index names per collection."""
+    created = {}
+    for collection_name, indexes in COLLECTION_INDEXES.items():
+        try:
+            created[collection_name] = await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            # Usually duplicate data blocking a unique index; keep serving and report it
+            logger.error(f"Index creation failed for {collection_name}: {str(e)}")
+            created[collection_name] = {"error": str(e)}
+    return created
+
+async def get_index_stats() -> dict:
+    """Report per-index usage counters from $indexStats for every managed collection."""
+    stats = {}
+    for collection_name in COLLECTION_INDEXES:
+        entries = []
+        async for entry in db[collection_name].aggregate([{"$indexStats": {}}]):
+            accesses = entry.get("accesses", {})
+            since = accesses.get("since")
+            entries.append({
+                "name": entry.get("name"),
+                "key": dict(entry.get("key", {})),
+                "ops": int(accesses.get("ops", 0)),
+                "since": since.isoformat() if isinstance(since, datetime) else since
+            })
+        stats[collection_name] = sorted(entries, key=lambda e: e["ops"], reverse=True)
+    return stats
+
+# =============================================================================
+# CONTENT-ADDRESSED BLOBS
+# =============================================================================
+
+# Resume and job description text is stored once per distinct content in the
+# `blobs` collection, keyed by SHA-256; sessions only keep `<field>_hash`.
+# Blobs no session points at any more are removed by BlobSweeper.
+BLOB_FIELDS = ("job_description", "resume")
+BLOB_SWEEP_GRACE_SECONDS = float(os.environ.get('BLOB_SWEEP_GRACE_SECONDS', '3600'))
+
+class BlobStore:
+    """Deduplicating text store with an in-memory LRU in front of Mongo."""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    async def put(self, text: Optional[str]) -> Optional[str]:
+        """Store text (once per distinct content) and return its hash."""
+        if not text:
+            return None
+        content_hash = self.content_hash(text)
+        # Written even on a cache hit: referenced_at keeps the sweep away from a
+        # blob whose session document hasn't been written yet
+        await db.blobs.update_one(
+            {"hash": content_hash},
+            {
+                "$setOnInsert": {
+                    "hash": content_hash,
+                    "content": text,
+                    "length": len(text),
+                    "created_at": datetime.now(timezone.utc).isoformat()
+                },
+                "$set": {"referenced_at": datetime.now(timezone.utc)}
+            },
+            upsert=True
+        )
+        self._remember(content_hash, text)
+        return content_hash
+
+    async def get_many(self, hashes) -> Dict[str, str]:
+        found, missing = {}, []
+        for content_hash in hashes:
+            if content_hash in self._cache:
+                self._cache.move_to_end(content_hash)
+                found[content_hash] = self._cache[content_hash]
+            else:
+                missing.append(content_hash)
+        if missing:
+            async for blob in db.blobs.find({"hash": {"$in": missing}}, {"_id": 0, "hash": 1, "content": 1}):
+                self._remember(blob["hash"], blob["content"])
+                found[blob["hash"]] = blob["content"]
+        return found
+
+    async def sweep(self, grace_seconds: float = BLOB_SWEEP_GRACE_SECONDS, batch_size: int = 500) -> dict:
+        """Delete blobs no session references, skipping any stored or reused within the grace period."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+        deleted = 0
+        batch = []
+        
+        async def flush():
+            nonlocal deleted
+            referenced = set()
+            for field in BLOB_FIELDS:
+                referenced.update(await db.sessions.distinct(f"{field}_hash", {f"{field}_hash": {"$in": batch}}))
+            unreferenced = [h for h in batch if h not in referenced]
+            if unreferenced:
+                result = await db.blobs.delete_many({
+                    "hash": {"$in": unreferenced},
+                    "referenced_at": {"$not": {"$gte": cutoff}}
+                })
+                deleted += result.deleted_count
+                for content_hash in unreferenced:
+                    self._cache.pop(content_hash, None)
+            batch.clear()
+        
+        async for blob in db.blobs.find({"referenced_at": {"$not": {"$gte": cutoff}}}, {"_id": 0, "hash": 1}):
+            batch.append(blob["hash"])
+            if len(batch) >= batch_size:
+                await flush()
+        if batch:
+            await flush()
+        return {"blobs_deleted": deleted}
+
+    def _remember(self, content_hash: str, text: str):
+        self._cache[content_hash] = text
+        self._cache.move_to_end(content_hash)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+blob_store = BlobStore()
+
+class BlobSweeper:
+    """Periodically drops blobs left behind by deleted, expired or edited sessions."""
+
+    def __init__(self, interval: float = 3600.0):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await blob_store.sweep()
+            except Exception as e:
+                logger.error(f"Blob sweep error: {str(e)}")
+
+blob_sweeper = BlobSweeper()
+
+async def blob_fields(values: dict) -> dict:
+    """Replace inline JD/resume text in `values` with blob hashes, for writing to a session."""
+    update = {}
+    for field in BLOB_FIELDS:
+        if field in values:
+            update[f"{field}_hash"] = await blob_store.put(values[field])
+    return update
+
+async def hydrate_sessions(sessions: List[dict]) -> List[dict]:
+    """Resolve `<field>_hash` references back into text, in place."""
+    hashes = {s.get(f"{field}_hash") for s in sessions for field in BLOB_FIELDS} - {None}
+    contents = await blob_store.get_many(hashes) if hashes else {}
+    for session in sessions:
+        for field in BLOB_FIELDS:
+            content_hash = session.pop(f"{field}_hash", None)
+            # Sessions written before blobs existed still carry the text inline
+            if content_hash and not session.get(field):
+                session[field] = contents.get(content_hash)
+            session.setdefault(field, None)
+    return sessions
+
+async def migrate_session_blobs(batch_size: int = 500) -> dict:
+    """Move inline JD/resume text on existing sessions into the blob store."""
+    migrated = 0
+    ops = []
+    query = {"$or": [{field: {"$type": "string"}} for field in BLOB_FIELDS]}
+    async for session in db.sessions.find(query, {"_id": 0, "id": 1, **{field: 1 for field in BLOB_FIELDS}}):
+        inline = {field: session[field] for field in BLOB_FIELDS if field in session}
+        ops.append(UpdateOne(
+            {"id": session["id"]},
+            {"$set": await blob_fields(inline), "$unset": {field: "" for field in inline}}
+        ))
+        migrated += 1
+        if len(ops) >= batch_size:
+            await db.sessions.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.sessions.bulk_write(ops, ordered=False)
+    return {"sessions_migrated": migrated}
+
+# =============================================================================
+# IN-PROCESS CACHES
+# =============================================================================
+
+class TTLCache:
+    """
+    Small LRU with a per-entry TTL and hit/miss counters. Invalidation is
+    local to this process; with several instances the TTL bounds staleness.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "ttl_seconds": self.ttl_seconds
+        }
+
+# Subscription documents (plan + billing period) per email. Every write to
+# db.subscriptions in this module invalidates the entry, so the TTL only
+# matters for writes made by other instances.
+entitlement_cache = TTLCache(ttl_seconds=float(os.environ.get('ENTITLEMENT_TTL_SECONDS', '30')), max_entries=10000)
+
+async def get_cached_subscription(email: str) -> dict:
+    """Read-through cache of a user's subscription document; {} when they have none."""
+    subscription = entitlement_cache.get(email)
+    if subscription is None:
+        subscription = await db.subscriptions.find_one({"email": email}, {"_id": 0}) or {}
+        entitlement_cache.set(email, subscription)
+    return subscription
+
+# Current usage-period counters per email, stored with the period they belong
+# to so a cached bucket from last month is never served after rollover
+usage_cache = TTLCache(ttl_seconds=float(os.environ.get('ENTITLEMENT_TTL_SECONDS', '30')), max_entries=10000)
+
+async def get_cached_usage(email: str, subscription: dict) -> dict:
+    """Read-through cache of the user's counters for the current usage period."""
+    period_start, period_end = current_usage_period(subscription)
+    cached = usage_cache.get(email)
+    if cached is not None and cached[0] == period_start:
+        return cached[1]
+    bucket = await db.usage_periods.find_one({"email": email, "period_start": period_start}, {"_id": 0}) or {}
+    usage = {field: bucket.get(field, 0) for field in USAGE_COUNTERS}
+    usage.update(period_start=period_start, period_end=period_end)
+    usage_cache.set(email, (period_start, usage))
+    return usage
+
+# What generate_answer needs from a session; JD/resume rarely change mid-interview
+SESSION_CONTEXT_FIELDS = ("company_name", "role_title", "expires_at", "created_at", "duration_limit") + tuple(f"{field}_hash" for field in BLOB_FIELDS) + BLOB_FIELDS
+session_context_cache = TTLCache(ttl_seconds=float(os.environ.get('SESSION_CONTEXT_TTL_SECONDS', '300')))
+
+async def get_session_context(session_id: str) -> Optional[dict]:
+    """Read-through cache of a live session's answer context."""
+    context = session_context_cache.get(session_id)
+    if context is not None:
+        return context
+    context = await db.sessions.find_one(
+        {"id": session_id, "deleted_at": None},
+        {"_id": 0, **{field: 1 for field in SESSION_CONTEXT_FIELDS}}
+    )
+    if context is None:
+        return None
+    await hydrate_sessions([context])
+    session_context_cache.set(session_id, context)
+    return context
+
+# =============================================================================
+# PAGINATION
+# =============================================================================
+
+# List views only need enough to render a card; the JD/resume text can be
+# several KB per session, so it is reduced to presence flags here.
+SESSION_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "name": 1,
+    "interview_type": 1,
+    "domain": 1,
+    "company_name": 1,
+    "role_title": 1,
+    "email": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "is_active": 1,
+    "duration_limit": 1,
+    "qa_count": 1,
+    "last_qa_at": 1,
+    "last_question_preview": 1,
+    "has_job_description": {"$or": [
+        {"$ne": [{"$ifNull": ["$job_description_hash", None]}, None]},
+        {"$gt": [{"$strLenCP": {"$ifNull": ["$job_description", ""]}}, 0]}
+    ]},
+    "has_resume": {"$or": [
+        {"$ne": [{"$ifNull": ["$resume_hash", None]}, None]},
+        {"$gt": [{"$strLenCP": {"$ifNull": ["$resume", ""]}}, 0]}
+    ]}
+}
+
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(*values) -> str:
+    """Encode the sort key of the last returned document as an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Decode a cursor produced by encode_cursor, rejecting anything malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Values go straight into Mongo filters, so anything but a string (e.g. an
+    # operator document like {"$ne": null}) would change the query
+    if not isinstance(values, list) or len(values) != size or not all(isinstance(v, str) for v in values):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+# =============================================================================
+# HTTP CACHING
+# =============================================================================
+
+PLANS_CACHE_SECONDS = int(os.environ.get('PLANS_CACHE_SECONDS', '3600'))
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match already names this ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+def encoded_json(value) -> tuple:
+    """Compact JSON bytes of value and a strong ETag over them."""
+    body = json.dumps(value, separators=(",", ":")).encode()
+    return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+def build_plan_catalog() -> Dict[Optional[str], tuple]:
+    """Encoded /plans (key None) and /plans/{plan_id} bodies with their ETags."""
+    catalog = {None: encoded_json({"plans": [{"id": plan_id, **plan} for plan_id, plan in SUBSCRIPTION_PLANS.items()]})}
+    for plan_id, plan in SUBSCRIPTION_PLANS.items():
+        catalog[plan_id] = encoded_json({"id": plan_id, **plan})
+    return catalog
+
+# SUBSCRIPTION_PLANS is static, so the catalog is encoded once per process
+PLAN_CATALOG = build_plan_catalog()
+
+def catalog_response(request: Request, key: Optional[str]) -> Response:
+    body, etag = PLAN_CATALOG[key]
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={PLANS_CACHE_SECONDS}, stale-while-revalidate={PLANS_CACHE_SECONDS * 24}"
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# =============================================================================
+# RATE LIMITING
+# =============================================================================
+
+# Route -> (burst capacity, tokens refilled per minute) for one email; each
+# client IP gets RATE_LIMIT_IP_MULTIPLIER times that, since IPs are shared
+RATE_LIMITS = {
+    "/api/generate-answer": (30, 30),
+    "/api/code-assist": (20, 20),
+    "/api/generate-mock-questions": (10, 10),
+    "/api/transcribe": (60, 60),
+}
+RATE_LIMIT_IP_MULTIPLIER = int(os.environ.get('RATE_LIMIT_IP_MULTIPLIER', '4'))
+# "memory" (per instance) or "mongo" (shared by all instances)
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'memory')
+# Proxies in front of us that append to X-Forwarded-For; 0 trusts the socket peer only
+RATE_LIMIT_PROXY_HOPS = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', '1'))
+# Request bodies up to this size are searched for an "email" field
+RATE_LIMIT_MAX_BODY_PEEK = 64 * 1024
+
+class MemoryTokenBuckets:
+    """Token buckets in a bounded LRU; state is per process."""
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def take(self, key: str, capacity: int, per_second: float) -> tuple:
+        """Take one token. Returns (allowed, tokens left)."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * per_second)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_entries:
+            self._buckets.popitem(last=False)
+        return allowed, tokens
+
+class MongoTokenBuckets:
+    """
+    Token buckets shared through db.rate_limits. Refill and take happen in one
+    find_one_and_update pipeline, so concurrent instances can't both spend
+    the last token. Idle buckets expire once they would be full again.
+    """
+
+    async def take(self, key: str, capacity: int, per_second: float) -> tuple:
+        now = datetime.now(timezone.utc)
+        elapsed_ms = {"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed_ms, per_second / 1000]}]}]}
+        bucket = await db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now, "expires_at": now + timedelta(seconds=capacity / per_second)}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]}
+                }}
+            ],
+            projection={"_id": 0, "allowed": 1, "tokens": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return bucket["allowed"], bucket["tokens"]
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware applying RATE_LIMITS to POSTs, with one bucket per
+    (route, email) and one per (route, client IP); a request must get a token
+    from both. The email comes from the `email` query parameter, the
+    X-User-Email header, or a small JSON body, which is replayed to the route
+    untouched. Responses carry RateLimit-Limit/-Remaining/-Reset headers and
+    exhausted buckets get a 429 with Retry-After. If the shared store is
+    unreachable the in-memory one takes over rather than failing requests.
+    """
+
+    def __init__(self, app, limits: dict = None, store=None):
+        self.app = app
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.store = store
+        self.fallback = MemoryTokenBuckets()
+
+    def _store(self):
+        if self.store is None:
+            self.store = MongoTokenBuckets() if RATE_LIMIT_STORE == "mongo" else self.fallback
+        return self.store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.limits:
+            await self.app(scope, receive, send)
+            return
+        
+        request = Request(scope)
+        capacity, per_minute = self.limits[scope["path"]]
+        per_second = per_minute / 60
+        
+        receive, body_email = await self._peek_email(scope, receive)
+        email = request.query_params.get("email") or request.headers.get("x-user-email") or body_email
+        keys = [(f"ip:{self._client_ip(request)}", capacity * RATE_LIMIT_IP_MULTIPLIER)]
+        if email:
+            keys.append((f"email:{email.lower()}", capacity))
+        
+        allowed, limit, remaining = True, capacity, capacity
+        for key, key_capacity in keys:
+            key_allowed, tokens = await self._take(f"{scope['path']}|{key}", key_capacity, per_second * key_capacity / capacity)
+            # Report whichever bucket is closest to empty
+            if tokens / key_capacity <= remaining / limit:
+                limit, remaining = key_capacity, tokens
+            allowed = allowed and key_allowed
+        
+        reset = math.ceil(max(0.0, 1 - remaining) / (per_second * limit / capacity))
+        headers = [
+            (b"ratelimit-limit", str(limit).encode()),
+            (b"ratelimit-remaining", str(int(remaining)).encode()),
+            (b"ratelimit-reset", str(reset).encode()),
+        ]
+        if not allowed:
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Too many requests, slow down and retry shortly"},
+                headers={"Retry-After": str(max(1, reset))}
+            )
+            response.raw_headers.extend(headers)
+            await response(scope, receive, send)
+            return
+        
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + headers}
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
+
+    async def _take(self, key: str, capacity: int, per_second: float) -> tuple:
+        try:
+            return await self._store().take(key, capacity, per_second)
+        except Exception as e:
+            logger.error(f"Rate limit store error: {str(e)}")
+            return await self.fallback.take(key, capacity, per_second)
+
+    @staticmethod
+    def _client_ip(request: Request) -> str:
+        forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if RATE_LIMIT_PROXY_HOPS and len(forwarded) >= RATE_LIMIT_PROXY_HOPS:
+            return forwarded[-RATE_LIMIT_PROXY_HOPS]
+        return request.client.host if request.client else "unknown"
+
+    @staticmethod
+    async def _peek_email(scope, receive) -> tuple:
+        """Read a small JSON body for the caller's email. Returns (receive replaying the body, email)."""
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length", b"")
+        if not content_length.isdigit() or int(content_length) > RATE_LIMIT_MAX_BODY_PEEK \
+                or not headers.get(b"content-type", b"").startswith(b"application/json"):
+            return receive, None
+        
+        messages, body, email = [], b"", None
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        try:
+            email = json.loads(body).get("email")
+        except (ValueError, AttributeError):
+            pass
+        
+        async def replay():
+            return messages.pop(0) if messages else await receive()
+        return replay, email if isinstance(email, str) else None
+
+# =============================================================================
+# SESSION EXPORT
+# =============================================================================
+
+EXPORT_BATCH_SIZE = 200
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+async def iter_session_qa(session_id: str):
+    """Q&A pairs of a session in conversation order, fetched in cursor batches."""
+    cursor = db.qa_pairs.find(
+        {"session_id": session_id}, {"_id": 0, "expires_at": 0}
+    ).sort([("created_at", ASCENDING), ("id", ASCENDING)]).batch_size(EXPORT_BATCH_SIZE)
+    async for qa in cursor:
+        yield qa
+
+async def buffered_chunks(parts, chunk_size: int = EXPORT_CHUNK_BYTES):
+    """Encode string parts and regroup them into ~chunk_size writes; the first part goes out immediately."""
+    buffer, size, first = [], 0, True
+    async for part in parts:
+        data = part.encode()
+        buffer.append(data)
+        size += len(data)
+        if first or size >= chunk_size:
+            yield b"".join(buffer)
+            buffer, size, first = [], 0, False
+    if buffer:
+        yield b"".join(buffer)
+
+def export_filename(name: Optional[str]) -> str:
+    return re.sub(r"[^\w.-]+", "_", name or "session").strip("_") or "session"
+
+def markdown_header(session: dict) -> str:
+    header = f"""# Interview Session: {session.get('name', 'Untitled')}
+
+## Session Details
+- **Company:** {session.get('company_name', 'N/A')}
+- **Role:** {session.get('role_title', 'N/A')}
+- **Interview Type:** {session.get('interview_type', 'N/A')}
+- **Domain:** {session.get('domain', 'N/A')}
+- **Created:** {session.get('created_at', 'N/A')}
+
+"""
+    if session.get('job_description'):
+        header += f"""## Job Description
+{session.get('job_description')}
+
+"""
+    if session.get('resume'):
+        header += f"""## Resume/Background
+{session.get('resume')}
+
+"""
+    return header + "## Questions & Answers\n\n"
+
+def markdown_qa(number: int, qa: dict) -> str:
+    return f"""### Question {number}
+**Q:** {qa.get('question', '')}
+
+**A:** {qa.get('answer', '')}
+
+*Model: {qa.get('ai_model', 'N/A')} | Tone: {qa.get('tone', 'N/A')}*
+
+---
+
+"""
+
+async def render_markdown(session: dict):
+    yield markdown_header(session)
+    number = 0
+    async for qa in iter_session_qa(session["id"]):
+        number += 1
+        yield markdown_qa(number, qa)
+
+async def render_markdown_envelope(session: dict):
+    """The Markdown export wrapped in the legacy JSON envelope, escaped piece by piece."""
+    yield f'{{"session_name":{json.dumps(session.get("name", "session"))},"markdown":"'
+    async for part in render_markdown(session):
+        yield json.dumps(part)[1:-1]
+    yield '"}'
+
+async def render_json(session: dict):
+    yield f'{{"session":{json.dumps(session)},"exported_at":"{datetime.now(timezone.utc).isoformat()}","qa_pairs":['
+    total = 0
+    async for qa in iter_session_qa(session["id"]):
+        yield ("," if total else "") + json.dumps(qa)
+        total += 1
+    yield f'],"total_questions":{total}}}'
+
+async def render_ndjson(session: dict):
+    yield json.dumps({"type": "session", **session}) + "\n"
+    total = 0
+    async for qa in iter_session_qa(session["id"]):
+        yield json.dumps({"type": "qa_pair", **qa}) + "\n"
+        total += 1
+    yield json.dumps({"type": "summary", "total_questions": total, "exported_at": datetime.now(timezone.utc).isoformat()}) + "\n"
+
+# format -> (media type, file extension, renderer)
+EXPORT_FORMATS = {
+    "json": ("application/json", "json", render_json),
+    "ndjson": ("application/x-ndjson", "ndjson", render_ndjson),
+    "md": ("text/markdown; charset=utf-8", "md", render_markdown),
+    "markdown": ("application/json", "json", render_markdown_envelope),
+}
+ARCHIVE_FORMATS = ("ndjson", "md")
+
+def pdf_paragraph(text) -> str:
+    """Escape free text for a reportlab Paragraph, keeping line breaks."""
+    return xml_escape(str(text or "")).replace("\n", "<br/>")
+
+def render_session_pdf(session: dict, qa_pairs: List[dict]) -> bytes:
+    """Lay out a session export as PDF. Runs in a worker process, so it only touches its arguments."""
+    styles = getSampleStyleSheet()
+    story = [
+        Paragraph(f"Interview Session: {pdf_paragraph(session.get('name') or 'Untitled')}", styles["Title"]),
+        Paragraph("Session Details", styles["Heading2"]),
+    ]
+    for label, field in [("Company", "company_name"), ("Role", "role_title"), ("Interview Type", "interview_type"),
+                         ("Domain", "domain"), ("Created", "created_at")]:
+        story.append(Paragraph(f"<b>{label}:</b> {pdf_paragraph(session.get(field) or 'N/A')}", styles["Normal"]))
+    for title, field in [("Job Description", "job_description"), ("Resume/Background", "resume")]:
+        if session.get(field):
+            story += [Paragraph(title, styles["Heading2"]), Paragraph(pdf_paragraph(session[field]), styles["BodyText"])]
+    
+    story.append(Paragraph("Questions &amp; Answers", styles["Heading2"]))
+    for number, qa in enumerate(qa_pairs, 1):
+        story += [
+            Paragraph(f"Question {number}", styles["Heading3"]),
+            Paragraph(f"<b>Q:</b> {pdf_paragraph(qa.get('question'))}", styles["BodyText"]),
+            Spacer(1, 4),
+            Paragraph(f"<b>A:</b> {pdf_paragraph(qa.get('answer'))}", styles["BodyText"]),
+            Paragraph(f"<i>Model: {pdf_paragraph(qa.get('ai_model', 'N/A'))} | Tone: {pdf_paragraph(qa.get('tone', 'N/A'))}</i>", styles["Italic"]),
+            HRFlowable(width="100%", spaceBefore=6, spaceAfter=6),
+        ]
+    
+    output = io.BytesIO()
+    SimpleDocTemplate(
+        output, pagesize=letter, title=f"Interview Session: {session.get('name') or 'Untitled'}",
+        leftMargin=0.75 * inch, rightMargin=0.75 * inch, topMargin=0.75 * inch, bottomMargin=0.75 * inch
+    ).build(story)
+    return output.getvalue()
+
+class PdfExportCache:
+    """
+    Rendered session PDFs on disk, named <session id>-<content hash>.pdf.
+    The hash covers the session document, whose qa_count/last_qa_at change
+    with every Q&A write, so a changed session never matches an old file and
+    older versions are dropped when the next one is rendered. Files of
+    sessions that were deleted or expired by TTL are removed by a periodic
+    sweep. Layout runs in a spawn-based process pool to keep the event loop
+    free, and concurrent requests for the same version share one render.
+    """
+
+    def __init__(self, cache_dir: Path, max_workers: int = 2, sweep_interval: float = 3600.0):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.sweep_interval = sweep_interval
+        self._executor = None
+        self._sweeper = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def start(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._sweeper = asyncio.create_task(self._run_sweeps())
+
+    def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            self._sweeper = None
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def path_for(self, session: dict) -> Path:
+        content_hash = hashlib.sha256(json.dumps(session, sort_keys=True, default=str).encode()).hexdigest()[:32]
+        return self.cache_dir / f"{session['id']}-{content_hash}.pdf"
+
+    async def get(self, session: dict) -> Path:
+        """Path of the session's current PDF, rendering it first if needed."""
+        path = self.path_for(session)
+        if path.exists():
+            return path
+        render = self._inflight.get(path.name)
+        if render is None:
+            render = asyncio.ensure_future(self._render(session, path))
+            self._inflight[path.name] = render
+            render.add_done_callback(lambda _: self._inflight.pop(path.name, None))
+        # Shielded so one client disconnecting doesn't cancel a render others wait on
+        await asyncio.shield(render)
+        return path
+
+    async def _render(self, session: dict, path: Path):
+        qa_pairs = [qa async for qa in iter_session_qa(session["id"])]
+        pdf = await asyncio.get_running_loop().run_in_executor(self._executor, render_session_pdf, session, qa_pairs)
+        await asyncio.to_thread(self._store, session["id"], path, pdf)
+
+    def _store(self, session_id: str, path: Path, pdf: bytes):
+        self._remove(session_id)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(pdf)
+        os.replace(tmp_path, path)
+
+    def _remove(self, session_id: str):
+        for stale in self.cache_dir.glob(f"{session_id}-*.pdf"):
+            stale.unlink(missing_ok=True)
+
+    async def invalidate(self, session_id: str):
+        await asyncio.to_thread(self._remove, session_id)
+
+    async def _run_sweeps(self):
+        while True:
+            try:
+                await self.sweep_orphans()
+            except Exception as e:
+                logger.error(f"PDF cache sweep error: {str(e)}")
+            await asyncio.sleep(self.sweep_interval)
+
+    async def sweep_orphans(self, batch_size: int = 500) -> dict:
+        """Delete cached PDFs whose session was deleted or expired."""
+        paths = await asyncio.to_thread(lambda: list(self.cache_dir.glob("*.pdf")))
+        by_session: Dict[str, List[Path]] = {}
+        for path in paths:
+            # Session ids are UUIDs, so split on the last dash only
+            by_session.setdefault(path.stem.rsplit("-", 1)[0], []).append(path)
+        session_ids = list(by_session)
+        orphaned = []
+        for i in range(0, len(session_ids), batch_size):
+            batch = session_ids[i:i + batch_size]
+            live = set(await db.sessions.distinct("id", {"id": {"$in": batch}, "deleted_at": None}))
+            orphaned += [path for session_id in batch if session_id not in live for path in by_session[session_id]]
+        await asyncio.to_thread(lambda: [path.unlink(missing_ok=True) for path in orphaned])
+        return {"files_deleted": len(orphaned)}
+
+PDF_CACHE_DIR = Path(os.environ.get('PDF_CACHE_DIR', str(ROOT_DIR / 'data' / 'pdf_cache')))
+pdf_exports = PdfExportCache(PDF_CACHE_DIR, max_workers=int(os.environ.get('PDF_RENDER_WORKERS', '2')))
+
+class ZipStreamBuffer:
+    """
+    Write-only sink for zipfile. It has no seek/tell, so zipfile writes
+    data descriptors after each entry instead of seeking back, and whatever
+    it has written so far can be drained and sent.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+
+    def write(self, data) -> int:
+        self._data += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._data)
+        self._data.clear()
+        return data
+
+def archive_entry_name(session: dict, extension: str) -> str:
+    """Date-prefixed, collision-free file name for a session inside an archive."""
+    return f"{(session.get('created_at') or '')[:10]}_{export_filename(session.get('name'))}_{session['id'][:8]}.{extension}"
+
+async def stream_account_archive(email: str, format: str, batch_size: int = 100):
+    """
+    ZIP of every session an email owns, one file per session, produced while
+    walking the sessions cursor. Each entry is compressed as its renderer
+    yields, and the zip bytes are handed on after every part, so only one
+    session batch and one entry's compressor state are ever held.
+    """
+    _, extension, render = EXPORT_FORMATS[format]
+    sink = ZipStreamBuffer()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED)
+    cursor = db.sessions.find(
+        {"email": email, "deleted_at": None}, {"_id": 0, "expires_at": 0}
+    ).sort([("created_at", ASCENDING), ("id", ASCENDING)]).batch_size(batch_size)
+    
+    batch = []
+    async for session in cursor:
+        batch.append(session)
+        if len(batch) < batch_size:
+            continue
+        async for chunk in _archive_sessions(archive, sink, batch, extension, render):
+            yield chunk
+        batch = []
+    async for chunk in _archive_sessions(archive, sink, batch, extension, render):
+        yield chunk
+    
+    archive.close()
+    yield sink.drain()
+
+async def _archive_sessions(archive: zipfile.ZipFile, sink: ZipStreamBuffer, sessions: List[dict], extension: str, render):
+    await hydrate_sessions(sessions)
+    for session in sessions:
+        created_at = parse_utc(session["created_at"]) if session.get("created_at") else datetime.now(timezone.utc)
+        info = zipfile.ZipInfo(archive_entry_name(session, extension), date_time=created_at.timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        # force_zip64: the entry size isn't known up front and may pass 2GB
+        with archive.open(info, mode="w", force_zip64=True) as entry:
+            async for chunk in buffered_chunks(render(session)):
+                entry.write(chunk)
+                data = sink.drain()
+                if data:
+                    yield data
+        # Remaining compressed bytes and the entry's data descriptor
+        yield sink.drain()
+
+# =============================================================================
+# DESKTOP ARCHIVES
+# =============================================================================
+
+DESKTOP_ARCHIVE_FILES = [
+    'main.js',
+    'preload.js',
+    'package.json',
+    'README.md',
+    'build.sh',
+    'assets/icon.svg'
+]
+
+# Platform -> (archive name, platform-specific build script)
+DESKTOP_BUILD_SCRIPTS = {
+    "windows": ("build-windows.bat", """@echo off
+echo Installing dependencies...
+call yarn install
+echo Building for Windows...
+call yarn build:win
+echo.
+echo Build complete! Check the dist folder for StealthInterview-Windows.exe
+pause
+"""),
+    "mac": ("build-mac.sh", """#!/bin/bash
+echo "Installing dependencies..."
+yarn install
+echo "Building for macOS..."
+yarn build:mac
+echo ""
+echo "Build complete! Check the dist folder for StealthInterview-Mac.dmg"
+"""),
+}
+
+DESKTOP_ARCHIVE_DIR = Path(os.environ.get('DESKTOP_ARCHIVE_DIR', str(ROOT_DIR / 'data' / 'desktop_archives')))
+
+class DesktopArchiveCache:
+    """
+    Per-platform desktop zips built once and kept on disk as
+    <platform>-<sources hash>.zip. The hash covers each source file's path,
+    mtime and content; contents are only re-read when a file's stat changes,
+    so a request costs a few stat calls until desktop/ is edited. The archive
+    takes the newest source mtime, which makes Last-Modified meaningful.
+    """
+
+    def __init__(self, source_dir: Path, archive_dir: Path):
+        self.source_dir = source_dir
+        self.archive_dir = archive_dir
+        self._digests: Dict[str, tuple] = {}  # path -> ((mtime_ns, size), sha256)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _sources(self) -> List[tuple]:
+        """(relative path, stat) of the archive's source files that exist."""
+        sources = []
+        for file_path in DESKTOP_ARCHIVE_FILES:
+            try:
+                sources.append((file_path, (self.source_dir / file_path).stat()))
+            except FileNotFoundError:
+                continue
+        return sources
+
+    def _digest(self, file_path: str, stat: os.stat_result) -> str:
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._digests.get(file_path)
+        if cached is None or cached[0] != signature:
+            cached = (signature, hashlib.sha256((self.source_dir / file_path).read_bytes()).hexdigest())
+            self._digests[file_path] = cached
+        return cached[1]
+
+    def archive_path(self, platform: str) -> tuple:
+        """(path of the current archive, newest source mtime) for a platform."""
+        sources = self._sources()
+        key = hashlib.sha256(DESKTOP_BUILD_SCRIPTS[platform][1].encode())
+        for file_path, stat in sources:
+            key.update(f"{file_path}\0{stat.st_mtime_ns}\0{self._digest(file_path, stat)}\0".encode())
+        newest = max((stat.st_mtime for _, stat in sources), default=time.time())
+        return self.archive_dir / f"{platform}-{key.hexdigest()[:32]}.zip", newest
+
+    async def get(self, platform: str) -> Path:
+        path, newest = self.archive_path(platform)
+        if path.exists():
+            return path
+        lock = self._locks.setdefault(platform, asyncio.Lock())
+        async with lock:
+            if not path.exists():
+                await asyncio.to_thread(self._build, platform, path, newest)
+        return path
+
+    def _build(self, platform: str, path: Path, newest: float):
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for file_path, _ in self._sources():
+                # Add to zip with folder structure
+                zip_file.write(self.source_dir / file_path, f"StealthInterview-Desktop/{file_path}")
+            script_name, script = DESKTOP_BUILD_SCRIPTS[platform]
+            zip_file.writestr(f"StealthInterview-Desktop/{script_name}", script)
+        os.utime(tmp_path, (newest, newest))
+        os.replace(tmp_path, path)
+        for stale in self.archive_dir.glob(f"{platform}-*.zip"):
+            if stale != path:
+                stale.unlink(missing_ok=True)
+
+desktop_archives = DesktopArchiveCache(DESKTOP_DIR, DESKTOP_ARCHIVE_DIR)
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    (start, end) inclusive for a single `bytes=` range, None to send the
+    whole file (no header, or several ranges), or (-1, -1) when unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(0, size - int(end_text)), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return (-1, -1)
+    return start, end
+
+# =============================================================================
+# PAYMENTS CLIENT
+# =============================================================================
+
+class FakeStripeCheckout:
+    """
+    In-process stand-in for StripeCheckout with the same three calls, for
+    exercising and benchmarking billing flows offline. Sessions are paid as
+    soon as they are created unless auto_pay is off, in which case mark_paid
+    settles them. Webhook bodies are Stripe-shaped JSON events and signatures
+    aren't checked.
+    """
+
+    def __init__(self, auto_pay: bool = True):
+        self.auto_pay = auto_pay
+        self.sessions: Dict[str, dict] = {}
+
+    async def create_checkout_session(self, checkout_request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        self.sessions[session_id] = {
+            "amount_total": int(round(checkout_request.amount * 100)),
+            "currency": checkout_request.currency,
+            "metadata": checkout_request.metadata or {},
+            "payment_status": "paid" if self.auto_pay else "unpaid"
+        }
+        url = checkout_request.success_url.replace("{CHECKOUT_SESSION_ID}", session_id)
+        return CheckoutSessionResponse(url=url, session_id=session_id)
+
+    def mark_paid(self, session_id: str):
+        self.sessions[session_id]["payment_status"] = "paid"
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatusResponse:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ValueError(f"No such checkout session: {session_id}")
+        return CheckoutStatusResponse(
+            status="complete" if session["payment_status"] == "paid" else "open",
+            payment_status=session["payment_status"],
+            amount_total=session["amount_total"],
+            currency=session["currency"],
+            metadata=session["metadata"]
+        )
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        event = json.loads(body)
+        checkout = event.get("data", {}).get("object", {})
+        return types.SimpleNamespace(
+            event_type=event.get("type"),
+            event_id=event.get("id"),
+            session_id=checkout.get("id"),
+            payment_status=checkout.get("payment_status"),
+            metadata=checkout.get("metadata", {})
+        )
+
+# One client for the process, set up by the startup hook. Stripe calls reuse
+# its HTTP connections instead of building a client per billing request.
+payments_client = None
+
+def configure_payments(client=None):
+    """Install the shared payments client; pass a FakeStripeCheckout to run billing offline."""
+    global payments_client
+    if client is None:
+        if PAYMENTS_BACKEND == "fake":
+            client = FakeStripeCheckout()
+        else:
+            if not STRIPE_WEBHOOK_URL:
+                logger.warning("STRIPE_WEBHOOK_URL is not set; Stripe will not be able to deliver webhooks")
+            client = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=STRIPE_WEBHOOK_URL)
+    payments_client = client
+    return client
+
+# =============================================================================
+# CHECKOUT SETTLEMENT & WEBHOOK QUEUE
+# =============================================================================
+
+BILLING_CYCLE_DAYS = {"monthly": 30, "quarterly": 90, "yearly": 365}
+WEBHOOK_EVENT_RETENTION_DAYS = int(os.environ.get('WEBHOOK_EVENT_RETENTION_DAYS', '30'))
+# Unsettled checkouts are looked up at Stripe at most this often
+STRIPE_STATUS_MIN_INTERVAL_SECONDS = float(os.environ.get('STRIPE_STATUS_MIN_INTERVAL_SECONDS', '10'))
+MAX_STATUS_WAIT_SECONDS = 25
+
+class CheckoutNotifier:
+    """
+    Wakes long-polling status requests when their checkout settles on this
+    instance. Requests served by another instance than the one that settled
+    the checkout simply time out and re-read Mongo.
+    """
+
+    def __init__(self):
+        self._waiters: Dict[str, list] = {}
 
-{tone_instructions.get(tone, tone_instructions['professional'])}{context_section}
+    async def wait(self, session_id: str, timeout: float) -> bool:
+        waiter = self._waiters.setdefault(session_id, [asyncio.Event(), 0])
+        waiter[1] += 1
+        try:
+            await asyncio.wait_for(waiter[0].wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiter[1] -= 1
+            if waiter[1] == 0 and self._waiters.get(session_id) is waiter:
+                del self._waiters[session_id]
 
-CRITICAL RULES:
-1. Give answers that sound like a real person speaking naturally
-2. Use first-person perspective ("I would...", "In my experience...", "I've found that...")
-3. Include occasional conversational elements but don't overdo it
-4. Be specific with examples from real-world scenarios
-5. Never say "As an AI" or reference being an AI assistant
-6. Avoid overly formal or robotic language
-7. If resume context is provided, reference specific experiences and projects when relevant
-8. If job description is provided, align answers to highlight relevant skills
+    def notify(self, session_id: str):
+        waiter = self._waiters.pop(session_id, None)
+        if waiter:
+            waiter[0].set()
 
-ANSWER FORMAT - Use this structure:
-**Key Points:**
-• [First key point - concise, actionable]
-• [Second key point - with specific example if relevant]
-• [Third key point - practical insight]
+checkout_notifier = CheckoutNotifier()
 
-**Brief Explanation:**
-[1-2 sentences expanding on the key points in a natural, conversational way. Keep it short and interview-ready.]
-"""
-    return base_prompt
+def checkout_settled(transaction: dict) -> bool:
+    """Whether a transaction's status can no longer change."""
+    return transaction.get("payment_status") == "paid" or transaction.get("checkout_status") in ("complete", "expired")
 
-async def get_ai_response(question: str, ai_model: str, domain: str, tone: str, context: str = None, job_description: str = None, resume: str = None, company_name: str = None, role_title: str = None) -> str:
-    """Generate AI response using the specified model."""
-    
-    system_prompt = get_system_prompt(domain, tone, job_description, resume, company_name, role_title)
-    
-    if context:
-        full_question = f"Context:\n{context}\n\nQuestion: {question}"
-    else:
-        full_question = question
-    
-    session_id = str(uuid.uuid4())
-    
-    chat = LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id=session_id,
-        system_message=system_prompt
+async def activate_subscription(transaction: dict) -> bool:
+    """
+    Put the buyer on the plan they paid for. The upsert only matches a
+    subscription that doesn't already carry this checkout, so a replayed
+    webhook or a racing status poll hits the unique email index instead of
+    applying the purchase twice. Returns True when this call applied it.
+    """
+    session_id = transaction["session_id"]
+    now = datetime.now(timezone.utc)
+    period_end = now + timedelta(days=BILLING_CYCLE_DAYS.get(transaction["billing_cycle"], 365))
+    subscription = UserSubscription(
+        user_id=transaction["email"],
+        email=transaction["email"],
+        plan=transaction["plan"],
+        billing_cycle=transaction["billing_cycle"],
+        status="active",
+        current_period_start=now.isoformat(),
+        current_period_end=period_end.isoformat(),
+        stripe_session_id=session_id
     )
+    try:
+        await db.subscriptions.update_one(
+            {"email": transaction["email"], "stripe_session_id": {"$ne": session_id}},
+            {"$set": subscription.model_dump()},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
     
-    # Configure model based on selection
-    if ai_model == "gpt-5.2":
-        chat.with_model("openai", "gpt-5.2")
-    elif ai_model == "claude-sonnet-4.5":
-        chat.with_model("anthropic", "claude-sonnet-4-5-20250929")
-    elif ai_model == "gemini-3-flash":
-        chat.with_model("gemini", "gemini-3-flash-preview")
-    else:
-        chat.with_model("openai", "gpt-5.2")
-    
-    user_message = UserMessage(text=full_question)
-    response = await chat.send_message(user_message)
-    
-    return response
+    entitlement_cache.invalidate(transaction["email"])
+    usage_cache.invalidate(transaction["email"])
+    # New plan, new history retention window
+    run_in_background(recompute_retention(transaction["email"]))
+    return True
+
+async def settle_checkout(session_id: str, payment_status: str, checkout_status: Optional[str] = None) -> Optional[dict]:
+    """Record a checkout's payment status and activate the subscription once it is paid."""
+    update = {"payment_status": payment_status, "updated_at": datetime.now(timezone.utc).isoformat()}
+    if payment_status == "paid":
+        update["status"] = "completed"
+        checkout_status = checkout_status or "complete"
+    if checkout_status:
+        update["checkout_status"] = checkout_status
+    transaction = await db.payment_transactions.find_one_and_update(
+        {"session_id": session_id},
+        {"$set": update},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if transaction and payment_status == "paid":
+        await activate_subscription(transaction)
+    if transaction and checkout_settled(transaction):
+        checkout_notifier.notify(session_id)
+    return transaction
+
+async def refresh_checkout_from_stripe(session_id: str) -> Optional[dict]:
+    """
+    Ask Stripe for an unsettled checkout's status, at most once per
+    STRIPE_STATUS_MIN_INTERVAL_SECONDS across all instances. The interval is
+    claimed on the transaction itself; returns None when another request
+    holds it or the checkout is unknown.
+    """
+    now = datetime.now(timezone.utc)
+    claimed = await db.payment_transactions.find_one_and_update(
+        {"session_id": session_id, "$or": [
+            {"stripe_checked_at": None},
+            {"stripe_checked_at": {"$lte": now - timedelta(seconds=STRIPE_STATUS_MIN_INTERVAL_SECONDS)}}
+        ]},
+        {"$set": {"stripe_checked_at": now}},
+        projection={"_id": 1}
+    )
+    if claimed is None:
+        return None
+    status = await payments_client.get_checkout_status(session_id)
+    return await settle_checkout(session_id, status.payment_status, status.status)
+
+class StripeWebhookQueue:
+    """
+    Durable queue between the webhook endpoint and checkout settlement.
+    The endpoint only verifies and stores the event, keyed by Stripe's event
+    id so redeliveries are dropped, then returns. Workers claim events with a
+    lease (so several instances can drain the queue and a crashed worker's
+    events come back) and retry failures up to max_attempts.
+    """
+
+    def __init__(self, poll_interval: float = 5.0, lease_seconds: float = 60.0, max_attempts: int = 10):
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def enqueue(self, event) -> bool:
+        """Persist a verified webhook event. Returns False for a redelivery of a known event."""
+        now = datetime.now(timezone.utc)
+        try:
+            await db.webhook_events.insert_one({
+                "event_id": event.event_id or str(uuid.uuid4()),
+                "event_type": event.event_type,
+                "session_id": event.session_id,
+                "payment_status": event.payment_status,
+                "status": "pending",
+                "attempts": 0,
+                "lease_until": now,
+                "received_at": now,
+                "expires_at": now + timedelta(days=WEBHOOK_EVENT_RETENTION_DAYS)
+            })
+        except DuplicateKeyError:
+            return False
+        self.wake()
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await self.process_pending()
+            except Exception as e:
+                logger.error(f"Webhook queue error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def process_pending(self) -> int:
+        processed = 0
+        while True:
+            now = datetime.now(timezone.utc)
+            event = await db.webhook_events.find_one_and_update(
+                {"status": {"$in": ["pending", "processing"]}, "lease_until": {"$lte": now}},
+                {
+                    "$set": {"status": "processing", "lease_until": now + timedelta(seconds=self.lease_seconds)},
+                    "$inc": {"attempts": 1}
+                },
+                sort=[("received_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            if event is None:
+                return processed
+            
+            try:
+                if event.get("session_id") and event.get("payment_status"):
+                    await settle_checkout(event["session_id"], event["payment_status"])
+                await db.webhook_events.update_one(
+                    {"_id": event["_id"]},
+                    {"$set": {"status": "done", "processed_at": datetime.now(timezone.utc)}}
+                )
+                processed += 1
+            except Exception as e:
+                logger.error(f"Webhook event {event['event_id']} failed: {str(e)}")
+                # Back off by attempt count before the next try
+                await db.webhook_events.update_one(
+                    {"_id": event["_id"]},
+                    {"$set": {
+                        "status": "failed" if event["attempts"] >= self.max_attempts else "pending",
+                        "lease_until": now + timedelta(seconds=self.poll_interval * 2 ** event["attempts"]),
+                        "last_error": str(e)
+                    }}
+                )
+
+webhook_queue = StripeWebhookQueue()
 
 # =============================================================================
 # ROUTES
@@ -516,30 +2915,93 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
 
+@api_router.get("/ready")
+async def readiness_check():
+    """Readiness probe: pings Mongo and reports pool pressure. Returns 503 when not ready."""
+    pool = pool_monitor.stats()
+    result = {"timestamp": datetime.now(timezone.utc).isoformat(), "pool": pool}
+    
+    started = time.perf_counter()
+    try:
+        await db.command("ping")
+        result["mongo_ping_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    except Exception as e:
+        logger.error(f"Readiness ping failed: {str(e)}")
+        result.update({"status": "not_ready", "reason": f"mongo ping failed: {str(e)}"})
+        return JSONResponse(status_code=503, content=result)
+    
+    if pool["checkout_wait_p50_ms"] > READY_MAX_CHECKOUT_WAIT_MS:
+        result.update({"status": "not_ready", "reason": "connection pool starved"})
+        return JSONResponse(status_code=503, content=result)
+    
+    result["status"] = "ready"
+    return result
+
+@api_router.get("/admin/indexes")
+async def index_stats():
+    """Report declared indexes and how often each one has been used"""
+    try:
+        return {"indexes": await get_index_stats(), "timestamp": datetime.now(timezone.utc).isoformat()}
+    except Exception as e:
+        logger.error(f"Index stats error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/admin/cache-stats")
+async def cache_stats():
+    """Hit rates of the in-process caches on this instance"""
+    return {
+        "session_context": session_context_cache.stats(),
+        "entitlements": entitlement_cache.stats(),
+        "usage": usage_cache.stats()
+    }
+
+@api_router.get("/admin/usage-rollups")
+async def get_usage_rollups(
+    granularity: str = "day",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    plan: Optional[str] = None,
+    usage_type: Optional[str] = None
+):
+    """Usage counts per bucket, plan and usage type, read from the pre-aggregated rollups"""
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(ROLLUP_GRANULARITIES)}")
+    try:
+        end_at = parse_utc(end) if end else datetime.now(timezone.utc)
+        start_at = parse_utc(start) if start else end_at - ROLLUP_GRANULARITIES[granularity] * 30
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO timestamps")
+    if (end_at - start_at) / ROLLUP_GRANULARITIES[granularity] > MAX_ROLLUP_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range spans more than {MAX_ROLLUP_BUCKETS} {granularity} buckets")
+    
+    query = {"granularity": granularity, "bucket": {"$gte": rollup_bucket(start_at, granularity), "$lt": end_at}}
+    if plan:
+        query["plan"] = plan
+    if usage_type:
+        query["usage_type"] = usage_type
+    rollups = await db.usage_rollups.find(query, {"_id": 0, "granularity": 0}).sort("bucket", ASCENDING).to_list(None)
+    for rollup in rollups:
+        rollup["bucket"] = rollup["bucket"].replace(tzinfo=timezone.utc).isoformat()
+    return {"granularity": granularity, "start": start_at.isoformat(), "end": end_at.isoformat(), "rollups": rollups}
+
 # =============================================================================
 # SUBSCRIPTION & PAYMENT ENDPOINTS
 # =============================================================================
 
 @api_router.get("/plans")
-async def get_subscription_plans():
+async def get_subscription_plans(request: Request):
     """Get all subscription plans with pricing"""
-    plans = []
-    for plan_id, plan_data in SUBSCRIPTION_PLANS.items():
-        plans.append({
-            "id": plan_id,
-            **plan_data
-        })
-    return {"plans": plans}
+    return catalog_response(request, None)
 
 @api_router.get("/plans/{plan_id}")
-async def get_plan_details(plan_id: str):
+async def get_plan_details(plan_id: str, request: Request):
     """Get details for a specific plan"""
     if plan_id not in SUBSCRIPTION_PLANS:
         raise HTTPException(status_code=404, detail="Plan not found")
-    return {"id": plan_id, **SUBSCRIPTION_PLANS[plan_id]}
+    return catalog_response(request, plan_id)
 
 @api_router.post("/subscriptions/checkout")
-async def create_checkout_session(request: CreateCheckoutRequest, http_request: Request):
+async def create_checkout_session(request: CreateCheckoutRequest):
     """Create a Stripe checkout session for subscription"""
     try:
         # Validate plan
@@ -562,11 +3024,6 @@ async def create_checkout_session(request: CreateCheckoutRequest, http_request:
         success_url = f"{request.origin_url}/subscription/success?session_id={{CHECKOUT_SESSION_ID}}"
         cancel_url = f"{request.origin_url}/pricing"
         
-        # Initialize Stripe checkout
-        host_url = str(http_request.base_url)
-        webhook_url = f"{host_url}api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-        
         # Create checkout request with multiple payment methods
         checkout_request = CheckoutSessionRequest(
             amount=amount,
@@ -583,7 +3040,7 @@ async def create_checkout_session(request: CreateCheckoutRequest, http_request:
         )
         
         # Create session
-        session = await stripe_checkout.create_checkout_session(checkout_request)
+        session = await payments_client.create_checkout_session(checkout_request)
         
         # Store transaction record
         transaction = PaymentTransaction(
@@ -615,75 +3072,33 @@ async def create_checkout_session(request: CreateCheckoutRequest, http_request:
         raise HTTPException(status_code=500, detail=f"Failed to create checkout: {str(e)}")
 
 @api_router.get("/subscriptions/status/{session_id}")
-async def get_checkout_status(session_id: str, http_request: Request):
-    """Get checkout session status and update subscription if paid"""
+async def get_checkout_status(session_id: str, wait: float = 0):
+    """
+    Get checkout session status from the local transaction record. With
+    wait > 0, an unsettled checkout is held open until the webhook settles it
+    or the wait (capped at 25s) runs out. Stripe is only asked when the local
+    record still isn't settled, and no more often than the configured interval.
+    """
     try:
-        # Initialize Stripe
-        host_url = str(http_request.base_url)
-        webhook_url = f"{host_url}api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-        
-        # Get status from Stripe
-        status = await stripe_checkout.get_checkout_status(session_id)
-        
-        # Get transaction
         transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
         
         if not transaction:
             raise HTTPException(status_code=404, detail="Transaction not found")
         
-        # Update transaction status
-        await db.payment_transactions.update_one(
-            {"session_id": session_id},
-            {"$set": {
-                "payment_status": status.payment_status,
-                "status": "completed" if status.payment_status == "paid" else transaction.get("status", "initiated"),
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
+        if not checkout_settled(transaction) and wait > 0:
+            # Re-read even on timeout: another instance may have settled it
+            await checkout_notifier.wait(session_id, min(wait, MAX_STATUS_WAIT_SECONDS))
+            transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
         
-        # If paid, create or update subscription
-        if status.payment_status == "paid":
-            # Check if already processed
-            existing_sub = await db.subscriptions.find_one({
-                "user_id": transaction["email"],
-                "stripe_session_id": session_id
-            })
-            
-            if not existing_sub:
-                # Calculate period end based on billing cycle
-                now = datetime.now(timezone.utc)
-                if transaction["billing_cycle"] == "monthly":
-                    period_end = now + timedelta(days=30)
-                elif transaction["billing_cycle"] == "quarterly":
-                    period_end = now + timedelta(days=90)
-                else:  # yearly
-                    period_end = now + timedelta(days=365)
-                
-                # Create or update subscription
-                subscription = UserSubscription(
-                    user_id=transaction["email"],
-                    email=transaction["email"],
-                    plan=transaction["plan"],
-                    billing_cycle=transaction["billing_cycle"],
-                    status="active",
-                    current_period_start=now.isoformat(),
-                    current_period_end=period_end.isoformat(),
-                    stripe_session_id=session_id
-                )
-                
-                # Upsert subscription
-                await db.subscriptions.update_one(
-                    {"email": transaction["email"]},
-                    {"$set": subscription.model_dump()},
-                    upsert=True
-                )
+        if not checkout_settled(transaction):
+            # Webhook may be late or lost; fall back to asking Stripe
+            transaction = await refresh_checkout_from_stripe(session_id) or transaction
         
         return {
-            "status": status.status,
-            "payment_status": status.payment_status,
-            "amount": status.amount_total / 100,  # Convert from cents
-            "currency": status.currency,
+            "status": transaction.get("checkout_status") or "open",
+            "payment_status": transaction.get("payment_status"),
+            "amount": transaction.get("amount"),
+            "currency": transaction.get("currency"),
             "plan": transaction.get("plan"),
             "billing_cycle": transaction.get("billing_cycle")
         }
@@ -703,35 +3118,31 @@ async def check_limits(email: str = None, usage_type: str = "live_interview"):
 @api_router.get("/subscriptions/{email}")
 async def get_user_subscription(email: str):
     """Get user's current subscription"""
-    subscription = await db.subscriptions.find_one({"email": email}, {"_id": 0})
+    subscription = await get_cached_subscription(email)
+    usage = await get_cached_usage(email, subscription)
     
     if not subscription:
         # Return free plan for unsubscribed users
-        return {
-            "subscription": {
-                "email": email,
-                "plan": "free",
-                "status": "active"
-            },
-            "plan_details": SUBSCRIPTION_PLANS["free"],
-            "usage": {
-                "live_interviews_used": 0,
-                "live_interviews_limit": 5,
-                "mock_interviews_used": 0,
-                "code_sessions_used": 0
-            }
+        subscription = {
+            "email": email,
+            "plan": "free",
+            "status": "active"
         }
     
     plan_details = SUBSCRIPTION_PLANS.get(subscription.get("plan", "free"), SUBSCRIPTION_PLANS["free"])
+    counters = {field: usage[field] for field in USAGE_COUNTERS}
     
     return {
-        "subscription": subscription,
+        # Counters on the subscription document predate usage periods; report the live ones
+        "subscription": {**subscription, **counters},
         "plan_details": plan_details,
         "usage": {
-            "live_interviews_used": subscription.get("live_interviews_used", 0),
+            "live_interviews_used": usage["live_interviews_used"],
             "live_interviews_limit": plan_details.get("live_interviews", 5),
-            "mock_interviews_used": subscription.get("mock_interviews_used", 0),
-            "code_sessions_used": subscription.get("code_sessions_used", 0)
+            "mock_interviews_used": usage["mock_interviews_used"],
+            "code_sessions_used": usage["code_sessions_used"],
+            "period_start": usage["period_start"],
+            "period_end": usage["period_end"]
         }
     }
 
@@ -742,17 +3153,7 @@ async def track_usage(email: str, usage_type: str):
     if usage_type not in valid_types:
         raise HTTPException(status_code=400, detail="Invalid usage type")
     
-    field_map = {
-        "live_interview": "live_interviews_used",
-        "mock_interview": "mock_interviews_used",
-        "code_session": "code_sessions_used"
-    }
-    
-    await db.subscriptions.update_one(
-        {"email": email},
-        {"$inc": {field_map[usage_type]: 1}},
-        upsert=True
-    )
+    await add_usage(email, usage_type, 1)
     
     return {"message": "Usage tracked"}
 
@@ -763,26 +3164,20 @@ async def stripe_webhook(request: Request):
         body = await request.body()
         signature = request.headers.get("Stripe-Signature")
         
-        host_url = str(request.base_url)
-        webhook_url = f"{host_url}api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-        
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        # Update transaction based on webhook
-        if webhook_response.session_id:
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {
-                    "payment_status": webhook_response.payment_status,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-        
-        return {"status": "received"}
+        webhook_response = await payments_client.handle_webhook(body, signature)
     except Exception as e:
         logger.error(f"Webhook error: {str(e)}")
         return {"status": "error", "message": str(e)}
+    
+    # Settled by the webhook queue; acknowledge as soon as the event is stored
+    try:
+        await webhook_queue.enqueue(webhook_response)
+    except Exception as e:
+        # Non-2xx makes Stripe redeliver the event later
+        logger.error(f"Webhook enqueue error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to store webhook event")
+    
+    return {"status": "received"}
 
 # Session Management
 @api_router.post("/sessions", response_model=Session)
@@ -792,7 +3187,8 @@ async def create_session(input: SessionCreate):
                  "mock_interview" if input.interview_type == "mock" else \
                  "code_session" if input.interview_type == "coding" else "live_interview"
     
-    limit_check = await check_subscription_limits(input.email, usage_type)
+    # Checks the limit and counts this session in one atomic operation
+    limit_check = await reserve_usage(input.email, usage_type)
     
     if not limit_check.get("allowed", True):
         raise HTTPException(
@@ -806,70 +3202,127 @@ async def create_session(input: SessionCreate):
             }
         )
     
-    session = Session(
-        name=input.name,
-        interview_type=input.interview_type,
-        domain=input.domain,
-        job_description=input.job_description,
-        resume=input.resume,
-        company_name=input.company_name,
-        role_title=input.role_title,
-        email=input.email,
-        duration_limit=limit_check.get("duration_limit", 15)
-    )
-    doc = session.model_dump()
-    await db.sessions.insert_one(doc)
-    
-    # Increment usage
-    if input.email:
-        await increment_usage(input.email, usage_type)
+    # Anything that fails from here on gives the reserved unit back
+    try:
+        session = Session(
+            name=input.name,
+            interview_type=input.interview_type,
+            domain=input.domain,
+            job_description=input.job_description,
+            resume=input.resume,
+            company_name=input.company_name,
+            role_title=input.role_title,
+            email=input.email,
+            duration_limit=limit_check.get("duration_limit", 15)
+        )
+        doc = session.model_dump(exclude=set(BLOB_FIELDS))
+        doc.update(await blob_fields(session.model_dump(include=set(BLOB_FIELDS))))
+        expires_at = retention_expiry(limit_check.get("plan", "free"), session.created_at)
+        if expires_at:
+            doc["expires_at"] = expires_at
+        await db.sessions.insert_one(doc)
+    except Exception:
+        await release_usage(input.email, usage_type)
+        raise
+    session_expiry.schedule(doc)
     
     return session
 
-@api_router.get("/sessions", response_model=List[Session])
-async def get_sessions():
-    sessions = await db.sessions.find({}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    return sessions
+@api_router.get("/sessions")
+async def get_sessions(email: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None, view: str = "full"):
+    """
+    List sessions newest first, using keyset pagination on (created_at, id).
+    Pass view=summary to drop job_description/resume text from each item.
+    The cursor for the next page is returned in the X-Next-Cursor header.
+    """
+    if view not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail="Invalid view")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    
+    query = {"deleted_at": None}
+    if email:
+        query["email"] = email
+    if cursor:
+        created_at, last_id = decode_cursor(cursor, 2)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": last_id}}
+        ]
+    
+    projection = SESSION_SUMMARY_PROJECTION if view == "summary" else {"_id": 0, "expires_at": 0}
+    sessions = await db.sessions.aggregate([
+        {"$match": query},
+        {"$sort": {"created_at": -1, "id": -1}},
+        {"$limit": limit + 1},
+        {"$project": projection}
+    ]).to_list(limit + 1)
+    
+    headers = {}
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(sessions[-1]["created_at"], sessions[-1]["id"])
+    if view == "full":
+        await hydrate_sessions(sessions)
+    
+    # Documents are written from the Session model, so skip re-validating each one
+    return JSONResponse(content=sessions, headers=headers)
 
 @api_router.get("/sessions/{session_id}", response_model=Session)
 async def get_session(session_id: str):
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    session = await db.sessions.find_one({"id": session_id, "deleted_at": None}, {"_id": 0})
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    return session
+    return (await hydrate_sessions([session]))[0]
 
 @api_router.put("/sessions/{session_id}", response_model=Session)
 async def update_session(session_id: str, update: SessionUpdate):
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    changes = {"$set": {k: v for k, v in update_data.items() if k not in BLOB_FIELDS}}
+    changes["$set"].update(await blob_fields(update_data))
+    # Drop any pre-blob inline copy so it can't shadow the new hash
+    inline = [field for field in BLOB_FIELDS if field in update_data]
+    if inline:
+        changes["$unset"] = {field: "" for field in inline}
     
-    result = await db.sessions.update_one(
-        {"id": session_id},
-        {"$set": update_data}
+    session = await db.sessions.find_one_and_update(
+        {"id": session_id, "deleted_at": None},
+        changes,
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
-    if result.matched_count == 0:
+    if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
-    return session
+    session_context_cache.invalidate(session_id)
+    return (await hydrate_sessions([session]))[0]
 
 @api_router.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
-    result = await db.sessions.delete_one({"id": session_id})
-    if result.deleted_count == 0:
+    # Tombstone now; the session document and its Q&A pairs are removed by session_cascade
+    now = datetime.now(timezone.utc).isoformat()
+    result = await db.sessions.update_one(
+        {"id": session_id, "deleted_at": None},
+        {"$set": {"deleted_at": now, "is_active": False, "updated_at": now}}
+    )
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Session not found")
-    # Also delete associated Q&A pairs
-    await db.qa_pairs.delete_many({"session_id": session_id})
+    session_context_cache.invalidate(session_id)
+    session_expiry.cancel(session_id)
+    # Off the request path; the orphan sweep catches anything this misses
+    run_in_background(pdf_exports.invalidate(session_id))
+    session_cascade.wake()
     return {"message": "Session deleted successfully"}
 
 @api_router.put("/sessions/{session_id}/end")
 async def end_session(session_id: str):
     result = await db.sessions.update_one(
-        {"id": session_id},
+        {"id": session_id, "deleted_at": None},
         {"$set": {"is_active": False, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Session not found")
+    session_context_cache.invalidate(session_id)
+    session_expiry.cancel(session_id)
     return {"message": "Session ended successfully"}
 
 # AI Answer Generation
@@ -883,8 +3336,17 @@ async def generate_answer(request: GenerateAnswerRequest):
         role = request.role_title
         
         if request.session_id:
-            session = await db.sessions.find_one({"id": request.session_id}, {"_id": 0})
+            session = await get_session_context(request.session_id)
             if session:
+                deadline = session_deadline(session)
+                if deadline is not None and time.time() > deadline:
+                    raise HTTPException(
+                        status_code=403,
+                        detail={
+                            "error": "session_expired",
+                            "message": "Session time limit reached. Please upgrade your plan for longer sessions."
+                        }
+                    )
                 job_desc = job_desc or session.get("job_description")
                 resume_text = resume_text or session.get("resume")
                 company = company or session.get("company_name")
@@ -913,20 +3375,20 @@ async def generate_answer(request: GenerateAnswerRequest):
                 tone=request.tone
             )
             doc = qa_pair.model_dump()
-            await db.qa_pairs.insert_one(doc)
+            if session and session.get("expires_at"):
+                # Pairs expire together with their session
+                doc["expires_at"] = session["expires_at"].isoformat()
+            # Stored (with the session timestamp and counters) by the write-behind persister
+            await qa_persister.enqueue(doc)
             qa_id = qa_pair.id
-            
-            # Update session timestamp
-            await db.sessions.update_one(
-                {"id": request.session_id},
-                {"$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
-            )
         
         return GenerateAnswerResponse(
             answer=answer,
             ai_model=request.ai_model,
             qa_id=qa_id
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating answer: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate answer: {str(e)}")
@@ -972,16 +3434,112 @@ Never mention being an AI."""
         raise HTTPException(status_code=500, detail=f"Failed to assist with code: {str(e)}")
 
 # Q&A History
-@api_router.get("/qa-pairs/{session_id}", response_model=List[QAPair])
-async def get_qa_pairs(session_id: str):
-    qa_pairs = await db.qa_pairs.find({"session_id": session_id}, {"_id": 0}).sort("created_at", 1).to_list(1000)
-    return qa_pairs
+@api_router.get("/qa-pairs/search")
+async def search_qa_pairs(q: str, email: Optional[str] = None, session_id: Optional[str] = None, limit: int = 20):
+    """
+    Full-text search over Q&A history, ranked by the text index score.
+    Scope with email (all of a user's sessions) and/or session_id.
+    """
+    terms = search_terms(q)
+    if not terms:
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    limit = max(1, min(limit, 100))
+    
+    query = {"$text": {"$search": q}}
+    if session_id:
+        query["session_id"] = session_id
+    if email:
+        owned = await db.sessions.distinct("id", {"email": email, "deleted_at": None})
+        if session_id and session_id not in owned:
+            return {"results": [], "total": 0}
+        if not session_id:
+            query["session_id"] = {"$in": owned}
+    
+    # Over-fetch a little so dropping pairs of deleted sessions still fills the page
+    hits = await db.qa_pairs.find(
+        query,
+        {"_id": 0, "score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"})]).limit(limit + 10).to_list(limit + 10)
+    
+    sessions = await db.sessions.find(
+        {"id": {"$in": list({hit["session_id"] for hit in hits})}, "deleted_at": None},
+        {"_id": 0, "id": 1, "name": 1, "company_name": 1}
+    ).to_list(None)
+    sessions_by_id = {s["id"]: s for s in sessions}
+    
+    results = []
+    for hit in hits:
+        session = sessions_by_id.get(hit["session_id"])
+        if not session:
+            continue
+        results.append({
+            "qa_id": hit["id"],
+            "session_id": hit["session_id"],
+            "session_name": session.get("name"),
+            "company_name": session.get("company_name"),
+            "score": round(hit["score"], 4),
+            "created_at": hit["created_at"],
+            "question": highlight_snippet(hit["question"], terms),
+            "answer": highlight_snippet(hit["answer"], terms)
+        })
+        if len(results) == limit:
+            break
+    return {"results": results, "total": len(results)}
+
+@api_router.get("/qa-pairs/{session_id}")
+async def get_qa_pairs(session_id: str, request: Request, since: Optional[str] = None, limit: int = 1000):
+    """
+    Q&A pairs for a session, oldest first. Pass the X-Next-Cursor value from a
+    previous response as `since` to receive only pairs added after it.
+    X-Has-More is "true" when the page was cut off at `limit`.
+    """
+    limit = max(1, min(limit, 1000))
+    # Pairs of a tombstoned session linger until the cascade gets to them
+    if await db.sessions.find_one({"id": session_id, "deleted_at": {"$ne": None}}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Session not found")
+    if qa_persister.is_pending(session_id=session_id):
+        await qa_persister.sync()
+    
+    query = {"session_id": session_id}
+    if since:
+        created_at, last_id = decode_cursor(since, 2)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": last_id}}
+        ]
+    
+    qa_pairs = await db.qa_pairs.find(query, {"_id": 0, "expires_at": 0}).sort([("created_at", 1), ("id", 1)]).to_list(limit + 1)
+    has_more = len(qa_pairs) > limit
+    qa_pairs = qa_pairs[:limit]
+    
+    # The cursor always points at the newest pair the client has seen, so an
+    # empty delta hands back the same cursor for the next poll
+    if qa_pairs:
+        next_cursor = encode_cursor(qa_pairs[-1]["created_at"], qa_pairs[-1]["id"])
+    else:
+        next_cursor = since or ""
+    
+    body = json.dumps(qa_pairs, separators=(",", ":")).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "X-Next-Cursor": next_cursor,
+        "X-Has-More": "true" if has_more else "false"
+    }
+    
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @api_router.delete("/qa-pairs/{qa_id}")
 async def delete_qa_pair(qa_id: str):
-    result = await db.qa_pairs.delete_one({"id": qa_id})
-    if result.deleted_count == 0:
+    if qa_persister.is_pending(qa_id=qa_id):
+        await qa_persister.sync()
+    deleted = await db.qa_pairs.find_one_and_delete({"id": qa_id}, projection={"_id": 0})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Q&A pair not found")
+    await record_qa_removed(deleted["session_id"], deleted)
     return {"message": "Q&A pair deleted successfully"}
 
 # Settings
@@ -1151,133 +3709,121 @@ async def transcribe_audio(request: TranscribeRequest):
 # Session Export
 @api_router.get("/sessions/{session_id}/export")
 async def export_session(session_id: str, format: str = "json"):
-    """Export session data including all Q&A pairs"""
+    """
+    Export session data including all Q&A pairs, streamed straight from the
+    Q&A cursor. Formats: json (single document), ndjson (one record per
+    line), md (plain Markdown), markdown (Markdown inside the legacy
+    {"markdown", "session_name"} envelope) and pdf (plans with pdf_export).
+    """
     try:
         # Get session
-        session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+        session = await db.sessions.find_one({"id": session_id, "deleted_at": None}, {"_id": 0, "expires_at": 0})
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
+        await hydrate_sessions([session])
+        if qa_persister.is_pending(session_id=session_id):
+            await qa_persister.sync()
         
-        # Get Q&A pairs
-        qa_pairs = await db.qa_pairs.find({"session_id": session_id}, {"_id": 0}).sort("created_at", 1).to_list(1000)
-        
-        export_data = {
-            "session": session,
-            "qa_pairs": qa_pairs,
-            "exported_at": datetime.now(timezone.utc).isoformat(),
-            "total_questions": len(qa_pairs)
-        }
-        
-        if format == "json":
-            return JSONResponse(content=export_data)
-        elif format == "markdown":
-            # Generate markdown format
-            md_content = f"""# Interview Session: {session.get('name', 'Untitled')}
-
-## Session Details
-- **Company:** {session.get('company_name', 'N/A')}
-- **Role:** {session.get('role_title', 'N/A')}
-- **Interview Type:** {session.get('interview_type', 'N/A')}
-- **Domain:** {session.get('domain', 'N/A')}
-- **Created:** {session.get('created_at', 'N/A')}
-
-"""
-            if session.get('job_description'):
-                md_content += f"""## Job Description
-{session.get('job_description')}
-
-"""
-            if session.get('resume'):
-                md_content += f"""## Resume/Background
-{session.get('resume')}
-
-"""
-            md_content += "## Questions & Answers\n\n"
-            
-            for i, qa in enumerate(qa_pairs, 1):
-                md_content += f"""### Question {i}
-**Q:** {qa.get('question', '')}
-
-**A:** {qa.get('answer', '')}
-
-*Model: {qa.get('ai_model', 'N/A')} | Tone: {qa.get('tone', 'N/A')}*
-
----
-
-"""
-            
-            return JSONResponse(content={"markdown": md_content, "session_name": session.get('name', 'session')})
-        else:
-            return JSONResponse(content=export_data)
-            
+        if format == "pdf":
+            owner = await get_cached_subscription(session["email"]) if session.get("email") else {}
+            if not SUBSCRIPTION_PLANS.get(owner.get("plan", "free"), SUBSCRIPTION_PLANS["free"]).get("pdf_export"):
+                raise HTTPException(
+                    status_code=403,
+                    detail={"error": "export_not_available", "message": "PDF export is available on the Executive plan"}
+                )
+            path = await pdf_exports.get(session)
+            return FileResponse(path, media_type="application/pdf", filename=f"{export_filename(session.get('name'))}_export.pdf")
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Export error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+    
+    if format not in EXPORT_FORMATS:
+        format = "json"
+    media_type, extension, render = EXPORT_FORMATS[format]
+    filename = f"{export_filename(session.get('name'))}_export.{extension}"
+    return StreamingResponse(
+        buffered_chunks(render(session)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.get("/export/all")
+async def export_all_sessions(email: str, format: str = "ndjson"):
+    """Stream a ZIP of all of a user's sessions, one NDJSON or Markdown file each"""
+    if format not in ARCHIVE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(ARCHIVE_FORMATS)}")
+    try:
+        subscription = await get_cached_subscription(email)
+        plan = SUBSCRIPTION_PLANS.get(subscription.get("plan", "free"), SUBSCRIPTION_PLANS["free"])
+        # Pairs still in the write-behind buffer should be part of the archive
+        await qa_persister.sync()
+    except Exception as e:
+        logger.error(f"Export error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+    
+    if not plan.get("export_enabled"):
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "export_not_available", "message": "Upgrade your plan to export your interview history"}
+        )
+    
+    filename = f"{export_filename(email.split('@')[0])}_sessions_{datetime.now(timezone.utc).strftime('%Y%m%d')}.zip"
+    return StreamingResponse(
+        stream_account_archive(email, format),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 # Desktop App Download
 @api_router.get("/desktop/download")
-async def download_desktop_app(platform: str = "windows"):
+async def download_desktop_app(request: Request, platform: str = "windows"):
     """Download desktop app source code as a zip file"""
     try:
         if not DESKTOP_DIR.exists():
             raise HTTPException(status_code=404, detail="Desktop app not found")
         
-        # Create zip file in memory
-        zip_buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Files to include
-            files_to_include = [
-                'main.js',
-                'preload.js',
-                'package.json',
-                'README.md',
-                'build.sh',
-                'assets/icon.svg'
-            ]
-            
-            for file_path in files_to_include:
-                full_path = DESKTOP_DIR / file_path
-                if full_path.exists():
-                    # Add to zip with folder structure
-                    zip_file.write(full_path, f"StealthInterview-Desktop/{file_path}")
-            
-            # Create a platform-specific build script
-            if platform == "windows":
-                build_content = """@echo off
-echo Installing dependencies...
-call yarn install
-echo Building for Windows...
-call yarn build:win
-echo.
-echo Build complete! Check the dist folder for StealthInterview-Windows.exe
-pause
-"""
-                zip_file.writestr("StealthInterview-Desktop/build-windows.bat", build_content)
-            else:
-                build_content = """#!/bin/bash
-echo "Installing dependencies..."
-yarn install
-echo "Building for macOS..."
-yarn build:mac
-echo ""
-echo "Build complete! Check the dist folder for StealthInterview-Mac.dmg"
-"""
-                zip_file.writestr("StealthInterview-Desktop/build-mac.sh", build_content)
+        path = await desktop_archives.get("windows" if platform == "windows" else "mac")
+        stat = path.stat()
+        # The file name carries the sources hash, so it doubles as a strong ETag
+        etag = f'"{path.stem}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+            "Cache-Control": "public, max-age=0, must-revalidate"
+        }
         
-        zip_buffer.seek(0)
+        if request.headers.get("if-none-match"):
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers=headers)
+        elif request.headers.get("if-modified-since"):
+            try:
+                if parsedate_to_datetime(request.headers["if-modified-since"]).timestamp() >= int(stat.st_mtime):
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
         
         filename = f"StealthInterview-Desktop-{platform.capitalize()}.zip"
+        byte_range = None
+        if request.headers.get("if-range", etag) == etag:
+            byte_range = parse_byte_range(request.headers.get("range"), stat.st_size)
+        if byte_range == (-1, -1):
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+        if byte_range:
+            start, end = byte_range
+            with path.open("rb") as archive:
+                archive.seek(start)
+                content = archive.read(end - start + 1)
+            return Response(
+                content=content,
+                status_code=206,
+                media_type="application/zip",
+                headers={**headers, "Content-Range": f"bytes {start}-{end}/{stat.st_size}"}
+            )
         
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}"
-            }
-        )
+        return FileResponse(path, media_type="application/zip", filename=filename, headers=headers, stat_result=stat)
         
     except HTTPException:
         raise
@@ -1440,14 +3986,65 @@ async def list_all_releases(platform: str = None, limit: int = 20):
 # Include the router in the main app
 app.include_router(api_router)
 
+# Added before CORS so CORS wraps it and 429s still carry CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Has-More", "ETag", "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "Retry-After"],
 )
 
+@app.on_event("startup")
+async def create_db_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def create_payments_client():
+    configure_payments()
+
+@app.on_event("startup")
+async def start_background_workers():
+    await qa_persister.start()
+    session_cascade.start()
+    usage_rollups.start()
+    webhook_queue.start()
+    await session_expiry.start()
+    pdf_exports.start()
+    blob_sweeper.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await blob_sweeper.stop()
+    pdf_exports.stop()
+    await session_expiry.stop()
+    await webhook_queue.stop()
+    await usage_rollups.stop()
+    await session_cascade.stop()
+    await qa_persister.stop()
     client.close()
+
+if __name__ == "__main__":
+    # Maintenance CLI, e.g. `python server.py index-stats`. Commands that
+    # rewrite data are only available here, not over HTTP.
+    import sys
+
+    commands = {
+        "ensure-indexes": ensure_indexes,
+        "index-stats": get_index_stats,
+        "backfill-session-summaries": backfill_session_summaries,
+        # Optionally scoped to one user: `python server.py recompute-retention <email>`
+        "recompute-retention": lambda email=None: recompute_retention(email) if email else recompute_all_retention(),
+        "migrate-session-blobs": migrate_session_blobs,
+        "sweep-blobs": blob_store.sweep,
+        "sweep-pdf-cache": pdf_exports.sweep_orphans,
+        "aggregate-usage": usage_rollups.aggregate
+    }
+    command = sys.argv[1] if len(sys.argv) > 1 else "index-stats"
+    if command not in commands:
+        print(f"Usage: python server.py [{' | '.join(commands)}]")
+        sys.exit(1)
+    print(json.dumps(asyncio.run(commands[command](*sys.argv[2:])), indent=2, default=str))
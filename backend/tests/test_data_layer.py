@@ -0,0 +1,352 @@
+"""
+Test suite for data layer endpoints:
+- Index bootstrap and index usage stats
+- Cursor-paginated session listing
+- Delta-sync Q&A history with ETags
+- Denormalized session Q&A counters
+- Tombstoned session deletion
+- Full-text Q&A search
+- Plan-driven history retention
+- Content-addressed resume/JD storage
+- Session context cache stats
+- Streaming session export
+- Account-wide ZIP export
+"""
+
+import pytest
+import requests
+import os
+import json
+import base64
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestIndexStats:
+    """Test index bootstrap is visible through the admin stats endpoint"""
+
+    def test_index_stats_lists_declared_indexes(self):
+        """Verify /admin/indexes reports the unique id index on sessions"""
+        response = requests.get(f"{BASE_URL}/api/admin/indexes")
+        assert response.status_code == 200
+
+        data = response.json()
+        assert "indexes" in data
+        session_index_names = [i["name"] for i in data["indexes"]["sessions"]]
+        assert "id_unique" in session_index_names, "sessions.id should have a unique index"
+
+        for index in data["indexes"]["qa_pairs"]:
+            assert isinstance(index["ops"], int), "ops should be an integer usage counter"
+
+
+class TestSessionListing:
+    """Test keyset pagination and the slim summary view on /sessions"""
+
+    def test_summary_view_omits_large_text_fields(self):
+        """Verify view=summary drops JD/resume text but keeps presence flags"""
+        email = "TEST_listing@example.com"
+        created = requests.post(
+            f"{BASE_URL}/api/sessions",
+            json={
+                "name": "Summary View Test",
+                "interview_type": "coding",
+                "domain": "backend",
+                "job_description": "Senior Python Developer " * 100,
+                "email": email
+            }
+        ).json()
+
+        response = requests.get(f"{BASE_URL}/api/sessions", params={"view": "summary", "email": email})
+        assert response.status_code == 200
+
+        session = next(s for s in response.json() if s["id"] == created["id"])
+        assert "job_description" not in session
+        assert "resume" not in session
+        assert session["has_job_description"] is True
+        assert session["has_resume"] is False
+
+        requests.delete(f"{BASE_URL}/api/sessions/{created['id']}")
+
+    def test_cursor_pagination_walks_all_pages(self):
+        """Verify pages are disjoint and the last page has no next cursor"""
+        email = "TEST_pagination@example.com"
+        created_ids = []
+        for i in range(3):
+            response = requests.post(
+                f"{BASE_URL}/api/sessions",
+                json={"name": f"Page Test {i}", "interview_type": "coding", "domain": "dsa", "email": email}
+            )
+            created_ids.append(response.json()["id"])
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"email": email, "limit": 2, "view": "summary"}
+            if cursor:
+                params["cursor"] = cursor
+            response = requests.get(f"{BASE_URL}/api/sessions", params=params)
+            assert response.status_code == 200
+            seen.extend(s["id"] for s in response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+
+        assert len(seen) == len(set(seen)), "Pages should not overlap"
+        assert set(created_ids) <= set(seen)
+
+        for session_id in created_ids:
+            requests.delete(f"{BASE_URL}/api/sessions/{session_id}")
+
+    def test_invalid_cursor_rejected(self):
+        """Verify a malformed cursor returns 400"""
+        response = requests.get(f"{BASE_URL}/api/sessions", params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400
+
+    def test_operator_cursor_rejected(self):
+        """Verify cursor values must be strings so they can't inject query operators"""
+        cursor = base64.urlsafe_b64encode(json.dumps([{"$ne": None}, "x"]).encode()).decode()
+        assert requests.get(f"{BASE_URL}/api/sessions", params={"cursor": cursor}).status_code == 400
+        assert requests.get(f"{BASE_URL}/api/qa-pairs/any-session", params={"since": cursor}).status_code == 400
+
+
+class TestQAHistoryDeltaSync:
+    """Test since-cursor and ETag handling on /qa-pairs/{session_id}"""
+
+    def test_since_cursor_and_etag(self):
+        """Verify a poll after the newest cursor is empty and a repeat fetch is a 304"""
+        session_id = requests.post(
+            f"{BASE_URL}/api/sessions",
+            json={"name": "Delta Sync Test", "interview_type": "phone", "domain": "backend"}
+        ).json()["id"]
+
+        requests.post(
+            f"{BASE_URL}/api/generate-answer",
+            json={"question": "What is a database index?", "domain": "backend", "session_id": session_id},
+            timeout=60
+        )
+
+        full = requests.get(f"{BASE_URL}/api/qa-pairs/{session_id}")
+        assert full.status_code == 200
+        assert len(full.json()) == 1
+        cursor = full.headers["X-Next-Cursor"]
+        assert cursor, "Non-empty page should return a cursor"
+
+        delta = requests.get(f"{BASE_URL}/api/qa-pairs/{session_id}", params={"since": cursor})
+        assert delta.status_code == 200
+        assert delta.json() == []
+        assert delta.headers["X-Next-Cursor"] == cursor
+
+        cached = requests.get(
+            f"{BASE_URL}/api/qa-pairs/{session_id}",
+            headers={"If-None-Match": full.headers["ETag"]}
+        )
+        assert cached.status_code == 304
+
+        requests.delete(f"{BASE_URL}/api/sessions/{session_id}")
+
+
+class TestSessionSummaryCounters:
+    """Test qa_count/last_qa_at/last_question_preview are maintained on write"""
+
+    def test_counters_follow_generate_and_delete(self):
+        """Verify counters increment on answer and reset when the pair is deleted"""
+        session_id = requests.post(
+            f"{BASE_URL}/api/sessions",
+            json={"name": "Counter Test", "interview_type": "phone", "domain": "backend"}
+        ).json()["id"]
+
+        answer = requests.post(
+            f"{BASE_URL}/api/generate-answer",
+            json={"question": "Explain eventual consistency", "domain": "backend", "session_id": session_id},
+            timeout=60
+        ).json()
+
+        session = requests.get(f"{BASE_URL}/api/sessions/{session_id}").json()
+        assert session["qa_count"] == 1
+        assert session["last_question_preview"] == "Explain eventual consistency"
+        assert session["last_qa_at"] is not None
+
+        requests.delete(f"{BASE_URL}/api/qa-pairs/{answer['qa_id']}")
+
+        session = requests.get(f"{BASE_URL}/api/sessions/{session_id}").json()
+        assert session["qa_count"] == 0
+        assert session["last_qa_at"] is None
+        assert session["last_question_preview"] is None
+
+        requests.delete(f"{BASE_URL}/api/sessions/{session_id}")
+
+    def test_summary_backfill_is_not_exposed_over_http(self):
+        """Verify the session summary backfill is CLI-only"""
+        response = requests.post(f"{BASE_URL}/api/admin/backfill/session-summaries")
+        assert response.status_code == 404
+
+
+class TestSessionDeletion:
+    """Test sessions disappear immediately once tombstoned"""
+
+    def test_deleted_session_is_hidden_immediately(self):
+        """Verify a deleted session 404s and drops out of listings right away"""
+        email = "TEST_delete@example.com"
+        session_id = requests.post(
+            f"{BASE_URL}/api/sessions",
+            json={"name": "Delete Test", "interview_type": "coding", "domain": "dsa", "email": email}
+        ).json()["id"]
+
+        response = requests.delete(f"{BASE_URL}/api/sessions/{session_id}")
+        assert response.status_code == 200
+
+        assert requests.get(f"{BASE_URL}/api/sessions/{session_id}").status_code == 404
+        assert requests.get(f"{BASE_URL}/api/qa-pairs/{session_id}").status_code == 404
+        listed = requests.get(f"{BASE_URL}/api/sessions", params={"email": email}).json()
+        assert session_id not in [s["id"] for s in listed]
+
+        # A second delete of the same session is a 404, not a second cascade
+        assert requests.delete(f"{BASE_URL}/api/sessions/{session_id}").status_code == 404
+
+
+class TestQASearch:
+    """Test /qa-pairs/search ranking, scoping and highlighting"""
+
+    def test_search_scoped_by_session_returns_highlights(self):
+        """Verify a stored question is found by keyword with match offsets"""
+        session_id = requests.post(
+            f"{BASE_URL}/api/sessions",
+            json={"name": "Search Test", "interview_type": "phone", "domain": "system_design"}
+        ).json()["id"]
+        requests.post(
+            f"{BASE_URL}/api/generate-answer",
+            json={"question": "How do Kafka partitions work?", "domain": "system_design", "session_id": session_id},
+            timeout=60
+        )
+
+        response = requests.get(
+            f"{BASE_URL}/api/qa-pairs/search",
+            params={"q": "kafka", "session_id": session_id}
+        )
+        assert response.status_code == 200
+
+        results = response.json()["results"]
+        assert len(results) == 1
+        hit = results[0]
+        assert hit["session_id"] == session_id
+        start, end = hit["question"]["matches"][0]
+        assert hit["question"]["text"][start:end].lower() == "kafka"
+
+        requests.delete(f"{BASE_URL}/api/sessions/{session_id}")
+
+    def test_empty_query_rejected(self):
+        """Verify a query with no searchable terms returns 400"""
+        response = requests.get(f"{BASE_URL}/api/qa-pairs/search", params={"q": "?"})
+        assert response.status_code == 400
+
+
+class TestHistoryRetention:
+    """Test retention windows are declared per plan and recompute runs"""
+
+    def test_plans_declare_retention_days(self):
+        """Verify every plan states its history retention (None = unlimited)"""
+        plans = {p["id"]: p for p in requests.get(f"{BASE_URL}/api/plans").json()["plans"]}
+        assert plans["free"]["history_retention_days"] == 7
+        assert plans["beginner"]["history_retention_days"] == 30
+        assert plans["advanced"]["history_retention_days"] == 90
+        assert plans["executive"]["history_retention_days"] is None
+
+    def test_recompute_is_not_exposed_over_http(self):
+        """Verify retention recompute and blob migration are CLI-only"""
+        for path in ("/api/admin/retention/recompute", "/api/admin/migrate/session-blobs"):
+            assert requests.post(f"{BASE_URL}{path}").status_code == 404
+
+
+class TestSessionBlobs:
+    """Test resume/JD text round-trips through the blob store"""
+
+    def test_text_round_trips_through_create_and_update(self):
+        """Verify sessions still return full JD/resume text after create and update"""
+        resume = "Ten years of Python and distributed systems. " * 50
+        session_id = requests.post(
+            f"{BASE_URL}/api/sessions",
+            json={"name": "Blob Test", "interview_type": "coding", "domain": "backend", "resume": resume}
+        ).json()["id"]
+
+        session = requests.get(f"{BASE_URL}/api/sessions/{session_id}").json()
+        assert session["resume"] == resume
+        assert session["job_description"] is None
+
+        updated = requests.put(
+            f"{BASE_URL}/api/sessions/{session_id}",
+            json={"job_description": "Staff Engineer, Payments"}
+        ).json()
+        assert updated["job_description"] == "Staff Engineer, Payments"
+        assert updated["resume"] == resume
+        assert "resume_hash" not in updated
+
+        requests.delete(f"{BASE_URL}/api/sessions/{session_id}")
+
+
+class TestCacheStats:
+    """Test in-process cache counters are reported"""
+
+    def test_session_context_cache_reported(self):
+        """Verify /admin/cache-stats exposes session context hit/miss counters"""
+        response = requests.get(f"{BASE_URL}/api/admin/cache-stats")
+        assert response.status_code == 200
+
+        stats = response.json()["session_context"]
+        for field in ["entries", "hits", "misses", "hit_rate", "ttl_seconds"]:
+            assert field in stats
+
+
+class TestSessionExport:
+    """Test session exports stream in each format"""
+
+    def test_ndjson_and_markdown_export(self):
+        """Verify NDJSON opens with the session and closes with a summary, and md is plain Markdown"""
+        response = requests.post(
+            f"{BASE_URL}/api/sessions",
+            json={"name": "TEST_export", "interview_type": "phone", "domain": "general"}
+        )
+        session_id = response.json()["id"]
+
+        response = requests.get(f"{BASE_URL}/api/sessions/{session_id}/export", params={"format": "ndjson"})
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines[0]["type"] == "session"
+        assert lines[0]["id"] == session_id
+        assert lines[-1] == {**lines[-1], "type": "summary", "total_questions": 0}
+
+        response = requests.get(f"{BASE_URL}/api/sessions/{session_id}/export", params={"format": "md"})
+        assert response.status_code == 200
+        assert response.text.startswith("# Interview Session: TEST_export")
+        assert "attachment" in response.headers["Content-Disposition"]
+
+        requests.delete(f"{BASE_URL}/api/sessions/{session_id}")
+
+    def test_pdf_export_requires_executive_plan(self):
+        """Verify PDF export is refused for a session whose owner isn't on a PDF plan"""
+        response = requests.post(
+            f"{BASE_URL}/api/sessions",
+            json={"name": "TEST_pdf", "interview_type": "phone", "domain": "general"}
+        )
+        session_id = response.json()["id"]
+
+        response = requests.get(f"{BASE_URL}/api/sessions/{session_id}/export", params={"format": "pdf"})
+        assert response.status_code == 403
+        assert response.json()["detail"]["error"] == "export_not_available"
+
+        requests.delete(f"{BASE_URL}/api/sessions/{session_id}")
+
+    def test_export_all_requires_export_plan(self):
+        """Verify the account ZIP export is refused on the free plan"""
+        response = requests.get(f"{BASE_URL}/api/export/all", params={"email": "TEST_export_free@example.com"})
+        assert response.status_code == 403
+        assert response.json()["detail"]["error"] == "export_not_available"
+
+    def test_export_all_rejects_unknown_format(self):
+        """Verify only NDJSON and Markdown archives are offered"""
+        response = requests.get(f"{BASE_URL}/api/export/all", params={"email": "TEST_export@example.com", "format": "pdf"})
+        assert response.status_code == 400
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
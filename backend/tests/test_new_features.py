@@ -188,6 +188,15 @@ class TestHealthAndBasicEndpoints:
         data = response.json()
         assert data["status"] == "healthy"
     
+    def test_ready_endpoint(self):
+        """Test readiness probe pings Mongo and reports pool stats"""
+        response = requests.get(f"{BASE_URL}/api/ready")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "ready"
+        assert data["mongo_ping_ms"] >= 0
+        assert "checkout_wait_p50_ms" in data["pool"]
+    
     def test_plans_endpoint(self):
         """Test subscription plans endpoint"""
         response = requests.get(f"{BASE_URL}/api/plans")
@@ -195,6 +204,30 @@ class TestHealthAndBasicEndpoints:
         data = response.json()
         assert "plans" in data
         assert len(data["plans"]) > 0
+    
+    def test_desktop_download_conditional_get(self):
+        """Test the desktop archive revalidates with its ETag and serves byte ranges"""
+        response = requests.get(f"{BASE_URL}/api/desktop/download", params={"platform": "windows"})
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert "Last-Modified" in response.headers
+
+        cached = requests.get(f"{BASE_URL}/api/desktop/download", params={"platform": "windows"}, headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+
+        partial = requests.get(f"{BASE_URL}/api/desktop/download", params={"platform": "windows"}, headers={"Range": "bytes=0-3"})
+        assert partial.status_code == 206
+        assert partial.content == response.content[:4] == b"PK\x03\x04"
+    
+    def test_rate_limit_headers(self):
+        """Test throttled endpoints report their token bucket state"""
+        response = requests.post(
+            f"{BASE_URL}/api/transcribe",
+            json={"audio_base64": "", "language": "en"},
+            headers={"X-User-Email": "TEST_ratelimit@example.com"}
+        )
+        assert "RateLimit-Limit" in response.headers
+        assert int(response.headers["RateLimit-Remaining"]) >= 0
 
 
 class TestMockInterviewQuestionFields:
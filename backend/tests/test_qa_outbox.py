@@ -0,0 +1,54 @@
+"""
+Test suite for the Q&A write-behind outbox:
+- Outbox writer survives disk errors while truncating
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from server import QAWriteBehind
+
+
+def qa_doc(n):
+    return {"id": f"qa-{n}", "session_id": "outbox-test", "question": f"Q{n}", "created_at": f"2026-01-01T00:00:0{n}"}
+
+
+class TestOutboxWriter:
+    """Test the outbox writer keeps serving appends when the disk misbehaves"""
+
+    def test_truncate_error_does_not_stall_enqueues(self, tmp_path, monkeypatch):
+        """Verify an OSError while truncating is logged and later enqueues still resolve"""
+        persister = QAWriteBehind(tmp_path / "qa_outbox.jsonl", flush_interval=0.01)
+        stored = []
+        truncate_attempts = []
+
+        async def persist(batch):
+            stored.extend(doc["id"] for doc in batch)
+
+        def failing_truncate():
+            truncate_attempts.append(1)
+            raise OSError("No space left on device")
+
+        monkeypatch.setattr(persister, "_persist", persist)
+        monkeypatch.setattr(persister, "_truncate_outbox", failing_truncate)
+
+        async def scenario():
+            await persister.start()
+            await persister.enqueue(qa_doc(1))
+            await persister.sync()
+            for _ in range(100):
+                if truncate_attempts:
+                    break
+                await asyncio.sleep(0.01)
+            await asyncio.wait_for(persister.enqueue(qa_doc(2)), timeout=2)
+            await persister.sync()
+            await asyncio.wait_for(persister.stop(), timeout=2)
+
+        asyncio.run(scenario())
+        assert truncate_attempts
+        assert stored == ["qa-1", "qa-2"]
+        # Nothing was truncated, so both pairs are still on disk for a replay
+        assert len(persister.outbox_path.read_text().splitlines()) == 2
@@ -0,0 +1,97 @@
+"""
+Test suite for server-side session expiry:
+- TimerWheel placement, cascading across levels and overflow
+- Session deadlines that gate generate-answer with 403 session_expired
+"""
+
+import random
+import sys
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from server import TimerWheel, session_deadline, SESSION_EXPIRY_GRACE_SECONDS
+
+
+def small_wheel():
+    # 4 slots x 3 levels: level 0 covers 4 ticks, level 1 16, level 2 64; beyond is overflow
+    return TimerWheel(tick_seconds=1.0, slots=4, levels=3, now=0)
+
+
+class TestTimerWheel:
+    """Test timers fire exactly on their tick wherever they start in the hierarchy"""
+
+    def test_fires_on_due_tick_across_levels_and_overflow(self):
+        """Verify timers on every level and in overflow fire on their own tick, not before"""
+        wheel = small_wheel()
+        due = {f"t{d}": d for d in (1, 3, 4, 5, 15, 16, 17, 63, 64, 65, 100, 255, 256, 300)}
+        for key, deadline in due.items():
+            wheel.add(key, deadline)
+
+        fired = {}
+        for tick in range(1, 310):
+            for key in wheel.advance(tick):
+                fired[key] = tick
+        assert fired == due
+        assert len(wheel) == 0
+
+    def test_fractional_deadline_rounds_up(self):
+        """Verify a deadline between ticks fires on the following tick"""
+        wheel = small_wheel()
+        wheel.add("k", 2.5)
+        assert wheel.advance(2) == []
+        assert wheel.advance(3) == ["k"]
+
+    def test_past_deadline_fires_on_next_advance(self):
+        """Verify a timer added after its deadline fires immediately"""
+        wheel = small_wheel()
+        wheel.advance(50)
+        wheel.add("late", 10)
+        assert wheel.advance(50) == ["late"]
+
+    def test_cancel_and_reschedule(self):
+        """Verify cancelled timers never fire and re-adding moves the deadline"""
+        wheel = small_wheel()
+        wheel.add("cancelled", 20)
+        wheel.add("moved", 20)
+        wheel.cancel("cancelled")
+        wheel.add("moved", 90)
+        assert "cancelled" not in wheel
+        assert wheel.advance(89) == []
+        assert wheel.advance(90) == ["moved"]
+
+    def test_matches_brute_force_with_random_steps(self):
+        """Verify random deadlines and uneven advance steps expire exactly like a sorted scan"""
+        rng = random.Random(46)
+        wheel = small_wheel()
+        deadlines = {f"k{i}": rng.uniform(0, 400) for i in range(500)}
+        for key, deadline in deadlines.items():
+            wheel.add(key, deadline)
+
+        now, remaining = 0, dict(deadlines)
+        while remaining:
+            now += rng.randint(1, 20)
+            expected = {key for key, deadline in remaining.items() if deadline <= now}
+            assert set(wheel.advance(now)) == expected
+            for key in expected:
+                del remaining[key]
+        assert len(wheel) == 0
+
+
+class TestSessionDeadline:
+    """Test the deadline generate-answer compares against before answering"""
+
+    def test_deadline_is_duration_plus_grace(self):
+        """Verify the deadline is created_at + duration_limit minutes + grace"""
+        created_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        deadline = session_deadline({"created_at": created_at.isoformat(), "duration_limit": 15})
+        expected = created_at + timedelta(minutes=15, seconds=SESSION_EXPIRY_GRACE_SECONDS)
+        assert deadline == expected.timestamp()
+
+    def test_sessions_without_limit_never_expire(self):
+        """Verify missing or non-positive duration limits have no deadline"""
+        created_at = datetime.now(timezone.utc).isoformat()
+        assert session_deadline({"created_at": created_at}) is None
+        assert session_deadline({"created_at": created_at, "duration_limit": -1}) is None
+        assert session_deadline({"created_at": "not-a-date", "duration_limit": 15}) is None
@@ -0,0 +1,127 @@
+"""
+Test suite for subscription and billing endpoints:
+- Atomic usage reservation on session creation
+- Entitlement cache invalidation
+- Period-bucketed usage counters
+- Usage event rollups
+- Cacheable plan catalog
+"""
+
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestUsageReservation:
+    """Test create_session enforces plan limits with a single atomic reservation"""
+
+    def test_free_plan_rejects_after_limit(self):
+        """Verify the 6th live interview on the free plan is rejected with 403"""
+        email = f"TEST_usage_{uuid.uuid4().hex[:8]}@example.com"
+        created = []
+        for i in range(5):
+            response = requests.post(
+                f"{BASE_URL}/api/sessions",
+                json={"name": f"Usage {i}", "interview_type": "phone", "domain": "general", "email": email}
+            )
+            assert response.status_code == 200, f"Session {i} should be allowed"
+            created.append(response.json()["id"])
+
+        response = requests.post(
+            f"{BASE_URL}/api/sessions",
+            json={"name": "Over Limit", "interview_type": "phone", "domain": "general", "email": email}
+        )
+        assert response.status_code == 403
+        detail = response.json()["detail"]
+        assert detail["error"] == "subscription_limit_reached"
+        assert detail["limit"] == 5
+        assert detail["used"] == 5
+
+        usage = requests.get(f"{BASE_URL}/api/subscriptions/{email}").json()["usage"]
+        assert usage["live_interviews_used"] == 5, "Rejected request must not consume usage"
+
+        for session_id in created:
+            requests.delete(f"{BASE_URL}/api/sessions/{session_id}")
+
+
+class TestEntitlementCache:
+    """Test cached entitlements never serve stale usage after a write on this instance"""
+
+    def test_track_usage_visible_immediately(self):
+        """Verify usage tracked right after a cached read is reflected in the next read"""
+        email = f"TEST_cache_{uuid.uuid4().hex[:8]}@example.com"
+        before = requests.get(f"{BASE_URL}/api/subscriptions/check-limits", params={"email": email}).json()
+        assert before["used"] == 0
+
+        requests.post(f"{BASE_URL}/api/subscriptions/{email}/usage", params={"usage_type": "live_interview"})
+
+        after = requests.get(f"{BASE_URL}/api/subscriptions/check-limits", params={"email": email}).json()
+        assert after["used"] == 1
+
+
+class TestUsagePeriods:
+    """Test usage is counted per billing period rather than on the subscription document"""
+
+    def test_free_user_period_is_calendar_month(self):
+        """Verify a free user's usage window is the current UTC calendar month"""
+        email = f"TEST_period_{uuid.uuid4().hex[:8]}@example.com"
+        requests.post(f"{BASE_URL}/api/subscriptions/{email}/usage", params={"usage_type": "mock_interview"})
+
+        usage = requests.get(f"{BASE_URL}/api/subscriptions/{email}").json()["usage"]
+        assert usage["mock_interviews_used"] == 1
+        assert usage["period_start"][8:19] == "01T00:00:00", "Free period should start on the 1st at midnight"
+        assert usage["period_end"] > usage["period_start"]
+
+
+class TestUsageRollups:
+    """Test the admin usage report served from pre-aggregated rollups"""
+
+    def test_rollups_report_shape(self):
+        """Verify daily rollups come back per plan and usage type"""
+        response = requests.get(f"{BASE_URL}/api/admin/usage-rollups", params={"granularity": "day"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["granularity"] == "day"
+        for rollup in data["rollups"]:
+            for field in ["bucket", "plan", "usage_type", "count"]:
+                assert field in rollup
+
+    def test_rollups_rejects_unknown_granularity(self):
+        """Verify only hour and day rollups are served"""
+        response = requests.get(f"{BASE_URL}/api/admin/usage-rollups", params={"granularity": "minute"})
+        assert response.status_code == 400
+
+    def test_aggregation_is_not_exposed_over_http(self):
+        """Verify an aggregation pass can only be triggered from the CLI"""
+        response = requests.post(f"{BASE_URL}/api/admin/usage-rollups/aggregate")
+        assert response.status_code == 404
+
+
+class TestPlanCatalog:
+    """Test the plan catalog is served with validators browsers and CDNs can reuse"""
+
+    def test_plans_etag_revalidation(self):
+        """Verify /plans sends a strong ETag and answers a matching If-None-Match with 304"""
+        response = requests.get(f"{BASE_URL}/api/plans")
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert not etag.startswith("W/")
+        assert "max-age" in response.headers["Cache-Control"]
+
+        response = requests.get(f"{BASE_URL}/api/plans", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_single_plan_etag_differs(self):
+        """Verify each plan has its own ETag"""
+        free = requests.get(f"{BASE_URL}/api/plans/free")
+        beginner = requests.get(f"{BASE_URL}/api/plans/beginner")
+        assert free.json()["id"] == "free"
+        assert free.headers["ETag"] != beginner.headers["ETag"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
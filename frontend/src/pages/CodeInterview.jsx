@@ -661,6 +661,12 @@ ${chatHistory.map(msg => `### ${msg.type === 'user' ? 'You' : 'AI'}\n${msg.conte
       setQuestion("");
     } catch (error) {
       console.error("Failed to get follow-up answer:", error);
+      const detail = error.response?.data?.detail;
+      if (detail?.error === "session_expired") {
+        // The server ends sessions at their plan's duration limit
+        toast.error(detail.message, { duration: 10000 });
+        return;
+      }
       toast.error("Failed to get answer. Please try again.");
     } finally {
       setIsGenerating(false);
@@ -63,7 +63,9 @@ const Dashboard = () => {
 
   const fetchSessions = async () => {
     try {
-      const response = await axios.get(`${API}/sessions`);
+      const response = await axios.get(`${API}/sessions`, {
+        params: { view: "summary", limit: 6 },
+      });
       setSessions(response.data);
     } catch (error) {
       console.error("Failed to fetch sessions:", error);
@@ -574,12 +576,12 @@ const Dashboard = () => {
                             <span className="px-2 py-0.5 bg-white/5 rounded text-xs font-mono text-white/50 capitalize">
                               {session.domain.replace("_", " ")}
                             </span>
-                            {session.job_description && (
+                            {session.has_job_description && (
                               <span className="px-2 py-0.5 bg-secondary/20 rounded text-xs font-mono text-secondary">
                                 JD
                               </span>
                             )}
-                            {session.resume && (
+                            {session.has_resume && (
                               <span className="px-2 py-0.5 bg-accent/20 rounded text-xs font-mono text-accent">
                                 CV
                               </span>
@@ -145,17 +145,24 @@ const LiveInterview = () => {
   const answerRef = useRef(null);
   const textareaRef = useRef(null);
   const timerRef = useRef(null);
+  const qaCursorRef = useRef(null);
 
   // Fetch session data
   useEffect(() => {
+    // A cursor from the previous session would skip this one's older pairs
+    qaCursorRef.current = null;
+    setTimeWarning(false);
+    setSessionExpired(false);
     if (sessionId) {
+      // The countdown starts once the session's created_at arrives, so a
+      // resumed session shows the time the server will actually allow
+      setSessionStartTime(null);
       fetchSession();
       fetchQAHistory();
+    } else {
+      setSessionStartTime(Date.now());
     }
     
-    // Initialize session start time
-    setSessionStartTime(Date.now());
-    
     return () => {
       // Cleanup timer
       if (timerRef.current) {
@@ -209,16 +216,33 @@ const LiveInterview = () => {
       if (response.data.duration_limit) {
         setDurationLimit(response.data.duration_limit);
       }
+      // The server measures the limit from created_at, not from when this page opened
+      const createdAt = Date.parse(response.data.created_at);
+      setSessionStartTime(Number.isNaN(createdAt) ? Date.now() : createdAt);
     } catch (error) {
       console.error("Failed to fetch session:", error);
+      setSessionStartTime(Date.now());
     }
   };
 
+  // Only pull pairs newer than the last one we have; the cursor comes back
+  // in X-Next-Cursor and X-Has-More says another page is waiting
   const fetchQAHistory = async () => {
     if (!sessionId) return;
     try {
-      const response = await axios.get(`${API}/qa-pairs/${sessionId}`);
-      setQaHistory(response.data);
+      let hasMore = true;
+      while (hasMore) {
+        const params = qaCursorRef.current ? { since: qaCursorRef.current } : {};
+        const response = await axios.get(`${API}/qa-pairs/${sessionId}`, { params });
+        const newPairs = response.data;
+        if (qaCursorRef.current) {
+          setQaHistory((prev) => [...prev, ...newPairs]);
+        } else {
+          setQaHistory(newPairs);
+        }
+        qaCursorRef.current = response.headers["x-next-cursor"] || qaCursorRef.current;
+        hasMore = response.headers["x-has-more"] === "true";
+      }
     } catch (error) {
       console.error("Failed to fetch Q&A history:", error);
     }
@@ -426,6 +450,13 @@ const LiveInterview = () => {
       
     } catch (error) {
       console.error("Failed to generate answer:", error);
+      const detail = error.response?.data?.detail;
+      if (detail?.error === "session_expired") {
+        // The server ends sessions at their duration limit even if our timer drifted
+        setSessionExpired(true);
+        toast.error(detail.message, { duration: 10000 });
+        return;
+      }
       toast.error("Failed to generate answer. Please try again.");
     } finally {
       setIsGenerating(false);
@@ -497,7 +528,8 @@ const LiveInterview = () => {
     
     const limitSeconds = durationLimit * 60;
     const remaining = Math.max(0, limitSeconds - elapsedTime);
-    const progress = (elapsedTime / limitSeconds) * 100;
+    // A resumed session can already be past its limit
+    const progress = Math.min(100, (elapsedTime / limitSeconds) * 100);
     const isLowTime = remaining <= 120;
     
     return (
@@ -525,7 +557,7 @@ const LiveInterview = () => {
               isLowTime ? 'text-orange-400' :
               'text-white'
             }`}>
-              {formatTime(elapsedTime)} / {formatTime(limitSeconds)}
+              {formatTime(Math.min(elapsedTime, limitSeconds))} / {formatTime(limitSeconds)}
             </span>
             {isLowTime && !sessionExpired && (
               <span className="text-xs text-orange-400 animate-pulse flex items-center gap-1">
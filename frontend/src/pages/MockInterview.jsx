@@ -222,6 +222,12 @@ const MockInterview = () => {
       setShowAiAnswer(true);
     } catch (error) {
       console.error("Failed to generate answer:", error);
+      const detail = error.response?.data?.detail;
+      if (detail?.error === "session_expired") {
+        // The server ends sessions at their plan's duration limit
+        toast.error(detail.message, { duration: 10000 });
+        return;
+      }
       toast.error("Failed to generate AI answer");
     } finally {
       setGeneratingAnswer(false);
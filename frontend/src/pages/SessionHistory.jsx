@@ -6,6 +6,7 @@ import { toast } from "sonner";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { ScrollArea } from "@/components/ui/scroll-area";
+import { Input } from "@/components/ui/input";
 import {
   AlertDialog,
   AlertDialogAction,
@@ -37,13 +38,32 @@ import {
   Video,
   Code,
   Download,
+  FileDown,
   FileJson,
   FileText,
   Brain,
+  Search,
 } from "lucide-react";
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
+// Renders a search snippet, wrapping each [start, end) match in <mark>
+const HighlightedSnippet = ({ snippet }) => {
+  const parts = [];
+  let last = 0;
+  snippet.matches.forEach(([start, end], i) => {
+    parts.push(snippet.text.slice(last, start));
+    parts.push(
+      <mark key={i} className="bg-primary/30 text-white rounded-sm px-0.5">
+        {snippet.text.slice(start, end)}
+      </mark>
+    );
+    last = end;
+  });
+  parts.push(snippet.text.slice(last));
+  return <>{parts}</>;
+};
+
 const SessionHistory = () => {
   const navigate = useNavigate();
   const { sessionId } = useParams();
@@ -53,6 +73,8 @@ const SessionHistory = () => {
   const [qaHistory, setQaHistory] = useState([]);
   const [loading, setLoading] = useState(true);
   const [copiedId, setCopiedId] = useState(null);
+  const [searchQuery, setSearchQuery] = useState("");
+  const [searchResults, setSearchResults] = useState(null);
 
   useEffect(() => {
     fetchSessions();
@@ -68,7 +90,9 @@ const SessionHistory = () => {
 
   const fetchSessions = async () => {
     try {
-      const response = await axios.get(`${API}/sessions`);
+      const response = await axios.get(`${API}/sessions`, {
+        params: { view: "summary" },
+      });
       setSessions(response.data);
     } catch (error) {
       console.error("Failed to fetch sessions:", error);
@@ -116,6 +140,23 @@ const SessionHistory = () => {
     }
   };
 
+  const searchQA = async (e) => {
+    e.preventDefault();
+    if (!searchQuery.trim()) {
+      setSearchResults(null);
+      return;
+    }
+    try {
+      const response = await axios.get(`${API}/qa-pairs/search`, {
+        params: { q: searchQuery.trim() },
+      });
+      setSearchResults(response.data.results);
+    } catch (error) {
+      console.error("Search failed:", error);
+      toast.error("Search failed");
+    }
+  };
+
   const copyAnswer = async (answer, qaId) => {
     try {
       await navigator.clipboard.writeText(answer);
@@ -153,39 +194,43 @@ const SessionHistory = () => {
     }
   };
 
+  // The server streams the export as an attachment, so let the browser
+  // download it directly instead of buffering the whole file in memory here
   const exportSession = async (format) => {
     if (!selectedSession) return;
-    
-    try {
-      const response = await axios.get(`${API}/sessions/${selectedSession.id}/export?format=${format}`);
-      
-      if (format === "json") {
-        const blob = new Blob([JSON.stringify(response.data, null, 2)], { type: "application/json" });
-        const url = URL.createObjectURL(blob);
-        const a = document.createElement("a");
-        a.href = url;
-        a.download = `${selectedSession.name.replace(/\s+/g, '_')}_export.json`;
-        document.body.appendChild(a);
-        a.click();
-        document.body.removeChild(a);
-        URL.revokeObjectURL(url);
-        toast.success("Session exported as JSON!");
-      } else if (format === "markdown") {
-        const blob = new Blob([response.data.markdown], { type: "text/markdown" });
-        const url = URL.createObjectURL(blob);
+
+    if (format === "pdf") {
+      // PDFs are plan-gated, so fetch first to surface a refusal as a toast
+      try {
+        const response = await axios.get(`${API}/sessions/${selectedSession.id}/export`, {
+          params: { format: "pdf" },
+          responseType: "blob",
+        });
+        const url = URL.createObjectURL(response.data);
         const a = document.createElement("a");
         a.href = url;
-        a.download = `${selectedSession.name.replace(/\s+/g, '_')}_export.md`;
+        a.download = `${selectedSession.name.replace(/\s+/g, '_')}_export.pdf`;
         document.body.appendChild(a);
         a.click();
         document.body.removeChild(a);
         URL.revokeObjectURL(url);
-        toast.success("Session exported as Markdown!");
+        toast.success("Session exported as PDF!");
+      } catch (error) {
+        console.error("Export error:", error);
+        toast.error(error.response?.status === 403
+          ? "PDF export is available on the Executive plan"
+          : "Failed to export session");
       }
-    } catch (error) {
-      console.error("Export error:", error);
-      toast.error("Failed to export session");
+      return;
     }
+
+    const a = document.createElement("a");
+    a.href = `${API}/sessions/${selectedSession.id}/export?format=${format === "markdown" ? "md" : format}`;
+    a.download = "";
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+    toast.success(format === "markdown" ? "Exporting session as Markdown..." : "Exporting session as JSON...");
   };
 
   return (
@@ -224,9 +269,55 @@ const SessionHistory = () => {
                   <CardTitle className="font-secondary font-bold text-sm tracking-tight uppercase">
                     ALL SESSIONS
                   </CardTitle>
+                  <form onSubmit={searchQA} className="relative mt-3">
+                    <Search className="w-4 h-4 text-white/40 absolute left-3 top-1/2 -translate-y-1/2" />
+                    <Input
+                      data-testid="qa-search-input"
+                      placeholder="Search questions & answers"
+                      value={searchQuery}
+                      onChange={(e) => {
+                        setSearchQuery(e.target.value);
+                        if (!e.target.value) setSearchResults(null);
+                      }}
+                      className="pl-9 bg-[#0A0A0A] border-white/10 focus:border-primary/50 font-mono text-xs"
+                    />
+                  </form>
                 </CardHeader>
                 <CardContent className="p-0">
-                  {loading ? (
+                  {searchResults !== null ? (
+                    searchResults.length === 0 ? (
+                      <div className="p-12 text-center">
+                        <Search className="w-10 h-10 text-white/20 mx-auto mb-4" />
+                        <p className="text-white/40 text-sm">No matching answers</p>
+                      </div>
+                    ) : (
+                      <ScrollArea className="h-[60vh]">
+                        <div className="p-3 space-y-2">
+                          {searchResults.map((hit) => (
+                            <div
+                              key={hit.qa_id}
+                              data-testid={`search-hit-${hit.qa_id}`}
+                              className="p-4 rounded-sm cursor-pointer bg-black/40 border border-white/5 hover:border-white/10 transition-all"
+                              onClick={() => {
+                                navigate(`/history/${hit.session_id}`);
+                                fetchSessionDetails(hit.session_id);
+                              }}
+                            >
+                              <p className="text-xs text-primary font-mono mb-1 truncate">
+                                {hit.session_name}
+                              </p>
+                              <p className="text-sm font-semibold mb-1">
+                                <HighlightedSnippet snippet={hit.question} />
+                              </p>
+                              <p className="text-xs text-white/50">
+                                <HighlightedSnippet snippet={hit.answer} />
+                              </p>
+                            </div>
+                          ))}
+                        </div>
+                      </ScrollArea>
+                    )
+                  ) : loading ? (
                     <div className="p-6">
                       <div className="space-y-3">
                         {[1, 2, 3].map((i) => (
@@ -316,7 +407,15 @@ const SessionHistory = () => {
                                 <span className="px-2 py-0.5 bg-white/5 rounded text-xs font-mono text-white/50 capitalize">
                                   {session.domain.replace("_", " ")}
                                 </span>
+                                <span className="px-2 py-0.5 bg-primary/10 rounded text-xs font-mono text-primary">
+                                  {session.qa_count || 0} Q&A
+                                </span>
                               </div>
+                              {session.last_question_preview && (
+                                <p className="mt-2 text-xs text-white/40 truncate">
+                                  {session.last_question_preview}
+                                </p>
+                              )}
                             </motion.div>
                           );
                         })}
@@ -364,6 +463,13 @@ const SessionHistory = () => {
                               <FileText className="w-4 h-4 mr-2" />
                               Export as Markdown
                             </DropdownMenuItem>
+                            <DropdownMenuItem 
+                              onClick={() => exportSession("pdf")}
+                              className="cursor-pointer"
+                            >
+                              <FileDown className="w-4 h-4 mr-2" />
+                              Export as PDF
+                            </DropdownMenuItem>
                           </DropdownMenuContent>
                         </DropdownMenu>
                         <Button
@@ -14,6 +14,11 @@ import {
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
+// Each status request is held open server-side until the payment settles or
+// this many seconds pass; give up after a few rounds
+const STATUS_WAIT_SECONDS = 20;
+const MAX_STATUS_POLLS = 6;
+
 const SubscriptionSuccess = () => {
   const navigate = useNavigate();
   const [searchParams] = useSearchParams();
@@ -22,28 +27,39 @@ const SubscriptionSuccess = () => {
 
   useEffect(() => {
     const sessionId = searchParams.get("session_id");
+    let cancelled = false;
     if (sessionId) {
-      verifyPayment(sessionId);
+      verifyPayment(sessionId, () => cancelled);
     } else {
       setStatus("error");
     }
+    return () => {
+      cancelled = true;
+    };
   }, [searchParams]);
 
-  const verifyPayment = async (sessionId) => {
+  const verifyPayment = async (sessionId, isCancelled) => {
     try {
-      const response = await axios.get(`${API}/subscriptions/status/${sessionId}`);
-      setPaymentData(response.data);
-      
-      if (response.data.payment_status === "paid") {
-        setStatus("success");
-      } else if (response.data.payment_status === "unpaid") {
+      for (let attempt = 0; attempt < MAX_STATUS_POLLS; attempt++) {
+        const response = await axios.get(`${API}/subscriptions/status/${sessionId}`, {
+          params: { wait: STATUS_WAIT_SECONDS },
+        });
+        if (isCancelled()) return;
+        setPaymentData(response.data);
+
+        if (response.data.payment_status === "paid") {
+          setStatus("success");
+          return;
+        }
+        if (response.data.status === "expired") {
+          setStatus("error");
+          return;
+        }
         setStatus("pending");
-      } else {
-        setStatus("error");
       }
     } catch (error) {
       console.error("Payment verification failed:", error);
-      setStatus("error");
+      if (!isCancelled()) setStatus("error");
     }
   };
 